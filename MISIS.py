@@ -1,14 +1,42 @@
+import time
+_import_started = time.perf_counter()
+
 import os
 import streamlit as st
-import requests
-import uuid
 import warnings
-import base64
-import json
-import time
-from app.common import steamlit_texts as TEXTS, system_prompt, giga, logger
-from app.common.tools import SearchPaperTool, PDFReaderTool
-from app.common import AUTH_DATA, MODEL, SCOPE, TEMPERATURE, TIMEOUT
+from app.common import steamlit_texts as TEXTS, system_prompt, logger
+from app.common.tools import default_tools
+from app.common.auth import token_manager
+from app.common.catalog import model_catalog
+from app.common.router import BIBTEX, CHAT, CONTACTS, PAPER_QA, READ, SEARCH, route as route_prompt
+from app.common.semantic_cache import semantic_cache
+from app.common.context import ConversationContext
+from app.common.papers import PaperRegistry, author_contacts
+from app.common.prefetch import prefetch_search_results
+from app.common.completions import StreamStats, build_payload, complete, stream as stream_chat
+from app.common.deadline import TurnCancelled, check_cancelled, turn_deadline
+from app.common.resilience import CircuitOpenError
+from app.common import metrics
+from app.common.resources import report_import_time
+from app.common import AUTH_DATA, MODEL, SCOPE, SEMANTIC_CACHE, SHOW_METRICS, STREAMING
+
+report_import_time(time.perf_counter() - _import_started)
+
+
+def superseded_check():
+    # Новое сообщение из st.chat_input приходит в сессию как запрос на перезапуск скрипта.
+    # Текущий прогон узнаёт о нём только на следующем вызове st.*, поэтому проверяем запрос сами
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        from streamlit.runtime.scriptrunner.script_requests import ScriptRequestType
+
+        script_requests = get_script_run_ctx().script_requests
+    except Exception as e:
+        logger.warning(f"Cannot watch for newer messages: {e}")
+        return None
+    if script_requests is None:
+        return None
+    return lambda: script_requests._state != ScriptRequestType.CONTINUE
 
 warnings.filterwarnings('ignore', message='Unverified HTTPS request')
 
@@ -26,138 +54,19 @@ if not AUTH_DATA:
     st.stop()
 
 try:
-    auth_url = "https://ngw.devices.sberbank.ru:9443/api/v2/oauth"
-    
-    cleaned_auth_data = AUTH_DATA.strip()
-    
-    try:
-        # Remove 'Basic ' prefix if present
-        if cleaned_auth_data.startswith('Basic '):
-            cleaned_auth_data = cleaned_auth_data[6:]
-        
-        # Decode the base64 string
-        decoded_token = base64.b64decode(cleaned_auth_data).decode('utf-8')
-        logger.info(f"Successfully decoded token: {decoded_token[:20]}...")
-        
-        # Validate the decoded token format (should be in format client_id:client_secret)
-        if ':' not in decoded_token:
-            raise ValueError("Decoded token must be in format 'client_id:client_secret'")
-            
-        client_id, client_secret = decoded_token.split(':', 1)
-        if not client_id or not client_secret:
-            raise ValueError("Both client_id and client_secret must be present in the token")
-            
-        logger.info("Token format validation successful")
-        logger.info(f"Client ID length: {len(client_id)}")
-        logger.info(f"Client Secret length: {len(client_secret)}")
-        
-    except Exception as e:
-        logger.error(f"Failed to decode or validate AUTH_DATA: {e}")
-        raise ValueError(f"AUTH_DATA validation failed: {str(e)}")
-    
-    auth_headers = {
-        'Content-Type': 'application/x-www-form-urlencoded',
-        'Accept': 'application/json',
-        'RqUID': str(uuid.uuid4()),
-        'Authorization': f'Basic {cleaned_auth_data}'
-    }
-    
-    auth_payload = {
-        'scope': 'GIGACHAT_API_PERS'
-    }
-
-    logger.info("Requesting access token...")
-    logger.info(f"Auth URL: {auth_url}")
-    logger.info(f"Auth headers: {json.dumps({k: v if k != 'Authorization' else '***' for k, v in auth_headers.items()}, indent=2)}")
-    logger.info(f"Auth payload: {json.dumps(auth_payload, indent=2)}")
-    
-    auth_response = requests.post(
-        auth_url, 
-        headers=auth_headers, 
-        data=auth_payload, 
-        verify=False,
-        timeout=30  
-    )
-    
-    logger.info(f"Auth response status: {auth_response.status_code}")
-    logger.info(f"Auth response headers: {json.dumps(dict(auth_response.headers), indent=2)}")
-    logger.info(f"Auth response text: {auth_response.text}")
-    
-    if auth_response.status_code != 200:
-        error_msg = f"Failed to get access token. Status code: {auth_response.status_code}"
-        if auth_response.text:
-            try:
-                error_data = auth_response.json()
-                error_msg += f", Error code: {error_data.get('code')}, Message: {error_data.get('message')}"
-            except:
-                error_msg += f", Response: {auth_response.text}"
-        raise ValueError(error_msg)
-    
-    try:
-        response_data = auth_response.json()
-        access_token = response_data.get('access_token')
-        if not access_token:
-            logger.error(f"No access_token in response. Full response: {json.dumps(response_data, indent=2)}")
-            raise ValueError("Access token not found in response")
-        
-        expires_in = response_data.get('expires_in')
-        if expires_in:
-            logger.info(f"Token will expire in {expires_in} seconds")
-            
-    except Exception as e:
-        logger.error(f"Failed to parse access token from response: {e}")
-        raise ValueError(f"Invalid response format: {auth_response.text}")
+    # Токен кэшируется на весь процесс и обновляется в фоне, поэтому на повторных
+    # запусках скрипта Streamlit здесь нет сетевых запросов
+    token_manager.configure(AUTH_DATA, 'GIGACHAT_API_PERS')
+    access_token = token_manager.get_token()
 
     logger.info("Successfully obtained access token")
 
-    models_url = "https://gigachat.devices.sberbank.ru/api/v1/models"
-    models_headers = {
-        'Accept': 'application/json',
-        'Authorization': f'Bearer {access_token}'
-    }
-    logger.info("Checking available models...")
-    logger.info(f"Models URL: {models_url}")
-    logger.info(f"Models headers: {models_headers}")
-    
-    max_retries = 3
-    retry_delay = 2
-    
-    for attempt in range(max_retries):
-        try:
-            models_response = requests.get(models_url, headers=models_headers, verify=False)
-            logger.info(f"Models response status: {models_response.status_code}")
-            
-            if models_response.status_code == 429:
-                if attempt < max_retries - 1:
-                    wait_time = retry_delay * (attempt + 1)
-                    logger.info(f"Rate limit hit. Waiting {wait_time} seconds before retry...")
-                    time.sleep(wait_time)
-                    continue
-                else:
-                    raise ValueError("Rate limit exceeded after all retries")
-            
-            logger.info(f"Models response text: {models_response.text}")
-            
-            if models_response.status_code != 200:
-                raise ValueError(f"Failed to get models. Status code: {models_response.status_code}, Response: {models_response.text}")
-            
-            break
-            
-        except Exception as e:
-            if attempt == max_retries - 1:
-                raise
-            logger.warning(f"Attempt {attempt + 1} failed: {str(e)}. Retrying...")
-            time.sleep(retry_delay)
-
-    giga.credentials = f"Bearer {access_token}"
-    giga.verify_ssl_certs = False
-    giga.timeout = TIMEOUT
-    giga.model = MODEL
-    giga.scope = 'GIGACHAT_API_PERS'
-    giga.base_url = "https://gigachat.devices.sberbank.ru/api/v1"
-    logger.info("GigaChat initialized successfully")
-
-    tools = [SearchPaperTool(), PDFReaderTool()]
+    # Список моделей загружается в фоне и кэшируется на MODELS_TTL секунд
+    model_catalog.bind(AUTH_DATA, 'GIGACHAT_API_PERS')
+    if model_catalog.is_available(MODEL) is False:
+        logger.warning(f"Model {MODEL} is not in the catalog: {', '.join(model_catalog.models())}")
+
+    tools = default_tools()
     logger.info("Tools created successfully")
 
 except Exception as e:
@@ -184,14 +93,23 @@ with st.sidebar:
         st.warning("Logo image not found. Please add logo.jpeg to resources/img/ directory.")
     st.markdown(TEXTS.COMMAND_EXAMPLES)
     st.markdown(TEXTS.EXAMPLE_PAPER)
+    if SHOW_METRICS:
+        with st.expander("Метрики"):
+            st.json(metrics.snapshot())
 
 # Initialize session state with proper error handling
 try:
     if "messages" not in st.session_state:
         st.session_state.messages = [{"role": "assistant", "content": "Привет, я МИСИСИК!"}]
 
-    if "chat_history" not in st.session_state:
-        st.session_state.chat_history = [{"role": "system", "content": system_prompt}]
+    if "context_memory" not in st.session_state:
+        st.session_state.context_memory = {}
+
+    if "prefetch_memory" not in st.session_state:
+        st.session_state.prefetch_memory = {}
+
+    if "paper_memory" not in st.session_state:
+        st.session_state.paper_memory = {}
 
 except Exception as e:
     logger.error(f"Error initializing session state: {e}")
@@ -202,6 +120,8 @@ for message in st.session_state.messages:
     try:
         with st.chat_message(message["role"]):
             st.markdown(message["content"], unsafe_allow_html=True)
+            if SHOW_METRICS and message.get("metrics"):
+                st.caption(", ".join(f"{k}: {v}" for k, v in message["metrics"].items()))
     except Exception as e:
         logger.error(f"Error displaying message: {e}")
         continue
@@ -223,88 +143,132 @@ if prompt := st.chat_input("Обратитесь ко мне..."):
         with st.spinner(TEXTS.WAITING):
             with st.chat_message("assistant"):
                 try:
-                    context = "\n".join([f"{msg['role']}: {msg['content']}" for msg in st.session_state.messages])
-                    
-                    full_prompt = f"{system_prompt}\n\nИстория диалога:\n{context}\n\nПользователь: {prompt}"
-                    
-                    logger.info("Preparing to send message to GigaChat")
-                    logger.info(f"Full prompt length: {len(full_prompt)}")
-                    logger.info(f"First 100 chars of prompt: {full_prompt[:100]}...")
-                    
-                    try:
-                        chat_url = "https://gigachat.devices.sberbank.ru/api/v1/chat/completions"
-                        chat_headers = {
-                            'Content-Type': 'application/json',
-                            'Accept': 'application/json',
-                            'Authorization': f'Bearer {access_token}'
-                        }
-                        
-                        chat_payload = {
-                            "model": MODEL,
-                            "messages": [
-                                {"role": "system", "content": system_prompt},
-                                {"role": "user", "content": prompt}
-                            ],
-                            "temperature": 0.7,
-                            "max_tokens": 1000
-                        }
-                        
-                        logger.info("Sending request to GigaChat API...")
-                        logger.info(f"Chat URL: {chat_url}")
-                        logger.info(f"Chat headers: {json.dumps({k: v if k != 'Authorization' else '***' for k, v in chat_headers.items()}, indent=2)}")
-                        logger.info(f"Chat payload: {json.dumps(chat_payload, indent=2)}")
-                        
-                        chat_response = requests.post(
-                            chat_url,
-                            headers=chat_headers,
-                            json=chat_payload,
-                            verify=False,
-                            timeout=30
-                        )
-                        
-                        logger.info(f"Chat response status: {chat_response.status_code}")
-                        logger.info(f"Chat response headers: {json.dumps(dict(chat_response.headers), indent=2)}")
-                        logger.info(f"Chat response text: {chat_response.text}")
+                    # Работа предыдущей реплики этой сессии, если она ещё идёт в фоне, больше не нужна
+                    previous_turn = st.session_state.get("active_turn")
+                    if previous_turn is not None:
+                        previous_turn.cancel()
+
+                    # Общий крайний срок реплики: все клиенты берут из него таймауты стадий,
+                    # по истечении оставшаяся работа отменяется и пользователь получает то, что успели.
+                    # Новое сообщение в той же сессии отменяет реплику сразу
+                    with turn_deadline(superseded=superseded_check()) as turn:
+                        st.session_state.active_turn = turn
+                        # Сначала выбираем обработчик, чтобы не тратить вызов модели на запросы к инструментам
+                        route = route_prompt(prompt, paper_in_context=bool(st.session_state.get("last_pdf_url")))
+                        # "статья №N" разрешается по списку из последнего поиска, без повторного поиска и модели
+                        papers = PaperRegistry(st.session_state.paper_memory)
+                        paper = papers.get(route.paper_number)
+                        pdf_url = route.url or (paper.pdf_url if paper is not None else None)
+                        response_metrics = None
+                        turn_started = time.perf_counter()
+
+                        # Перефразированные повторы отдаём из семантического кэша. Свободный чат кэшируем
+                        # только для первого вопроса в сессии: дальше ответ зависит от истории диалога
+                        semantic_lookup = None
+                        first_question = sum(msg["role"] == "user" for msg in st.session_state.messages) == 1
+                        if SEMANTIC_CACHE and (route.name == SEARCH or (route.name == CHAT and first_question)):
+                            try:
+                                semantic_lookup = semantic_cache.lookup(route.name, route.query)
+                            except Exception as e:
+                                logger.error(f"Semantic cache lookup failed: {e}")
+
+                        degraded = False
+
+                        try:
+                            if semantic_lookup is not None and semantic_lookup.answer is not None:
+                                response_text = semantic_lookup.answer
+                                response_metrics = {"semantic_cache": True}
+                                if route.name == SEARCH:
+                                    papers.update(response_text)
+                                    # Ответ из кэша тоже ведёт к чтению статей из списка
+                                    prefetch_search_results(response_text, st.session_state.prefetch_memory)
+                            elif route.name == SEARCH:
+                                logger.info("Using paper search tool")
+                                response_text = tools[SEARCH]._run(route.query, prefetch_memory=st.session_state.prefetch_memory)
+                                papers.update(response_text)
+                            elif route.name == READ and pdf_url:
+                                logger.info(f"Using PDF reader tool for file: {pdf_url}")
+                                response_text = tools[READ]._run(pdf_url)["markdown"]
+                                if not response_text.startswith("Ошибка"):
+                                    # Следующие вопросы о статье отвечаются по её разделам
+                                    st.session_state.last_pdf_url = pdf_url
+                            elif route.name == PAPER_QA and (pdf_url or st.session_state.get("last_pdf_url")):
+                                pdf_url = pdf_url or st.session_state.last_pdf_url
+                                logger.info(f"Using paper QA tool for file: {pdf_url}")
+                                response_text = tools[PAPER_QA]._run(route.query, pdf_url)["markdown"]
+                            elif route.name == BIBTEX:
+                                logger.info("Using BibTeX generator tool")
+                                # Для статьи из списка передаём её метаданные, а не текст запроса
+                                response_text = tools[BIBTEX]._run(paper.metadata() if paper is not None else route.query)["markdown"]
+                            elif route.name == CONTACTS:
+                                logger.info("Answering author contacts from the paper record")
+                                # Без номера статьи речь о статье, которую читали последней
+                                contacts_url = pdf_url or (st.session_state.get("last_pdf_url") if paper is None else None)
+                                response_text = author_contacts(paper, contacts_url)
+                            else:
+                                logger.info("Preparing to send message to GigaChat")
                         
-                        if chat_response.status_code != 200:
-                            error_msg = f"Failed to get chat completion. Status code: {chat_response.status_code}"
-                            if chat_response.text:
                                 try:
-                                    error_data = chat_response.json()
-                                    error_msg += f", Error: {error_data.get('error', {}).get('message', chat_response.text)}"
-                                except:
-                                    error_msg += f", Response: {chat_response.text}"
-                            raise ValueError(error_msg)
-                        
-                        response_data = chat_response.json()
-                        if not response_data.get('choices'):
-                            raise ValueError("No choices in response")
-                            
-                        response_text = response_data['choices'][0]['message']['content']
-                        logger.info(f"Response length: {len(response_text)}")
-                        logger.info(f"First 100 chars of response: {response_text[:100]}...")
-                        
-                    except Exception as e:
-                        logger.error(f"Error in GigaChat API call: {str(e)}")
-                        logger.error(f"Error type: {type(e)}")
-                        logger.error(f"Error details: {e.__dict__ if hasattr(e, '__dict__') else 'No details available'}")
-                        logger.error("Full error traceback:", exc_info=True)
-                        raise
-
-                    if "найди мне статьи" in prompt.lower():
-                        logger.info("Using paper search tool")
-                        response_text = tools[0]._run(prompt)
-                    elif "прочитай эту статью" in prompt.lower() or "https://" in prompt:
-                        file_path = prompt.split("https://")[-1].split()[0]
-                        logger.info(f"Using PDF reader tool for file: {file_path}")
-                        response_text = tools[1]._run(file_path)
-
-                    logger.info("Adding response to session state")
-                    st.session_state.messages.append({"role": "assistant", "content": response_text})
+                                    # История диалога укладывается в бюджет токенов, старые реплики сворачиваются в память
+                                    context = ConversationContext(st.session_state.context_memory)
+                                    chat_payload = build_payload(
+                                        context.build(system_prompt, st.session_state.messages[:-1], prompt),
+                                        temperature=0.7,
+                                        max_tokens=min(1000, model_catalog.capabilities(MODEL).max_output_tokens)
+                                    )
+
+                                    if STREAMING:
+                                        # Ответ дописывается в контейнер по мере генерации
+                                        placeholder = st.empty()
+                                        stream_stats = StreamStats()
+                                        response_text = ""
+                                        try:
+                                            for delta in stream_chat(chat_payload, stats=stream_stats):
+                                                response_text += delta
+                                                placeholder.markdown(response_text + "▌", unsafe_allow_html=True)
+                                        except TimeoutError as e:
+                                            logger.error(f"Streaming stopped by turn deadline: {e}")
+                                            response_text = response_text + TEXTS.PARTIAL_ANSWER if response_text else TEXTS.DEADLINE_EXCEEDED
+                                        placeholder.empty()
+                                        response_metrics = stream_stats.as_dict()
+                                    else:
+                                        response_text = complete(chat_payload)
+                                    logger.info(f"First 100 chars of response: {response_text[:100]}...")
+
+                                except TimeoutError as e:
+                                    logger.error(f"GigaChat API call exceeded the turn deadline: {e}")
+                                    response_text = TEXTS.DEADLINE_EXCEEDED
+                                except CircuitOpenError:
+                                    raise
+                                except Exception as e:
+                                    logger.error(f"Error in GigaChat API call: {str(e)}")
+                                    logger.error(f"Error type: {type(e)}")
+                                    logger.error(f"Error details: {e.__dict__ if hasattr(e, '__dict__') else 'No details available'}")
+                                    logger.error("Full error traceback:", exc_info=True)
+                                    raise
+                        except CircuitOpenError as e:
+                            # GigaChat сейчас сбоит: отвечаем сразу похожим ответом из кэша, а не ждём таймаутов
+                            logger.warning(f"Serving a degraded answer: {e}")
+                            degraded = True
+                            stale_answer = semantic_cache.closest(route.name, route.query, semantic_lookup) if SEMANTIC_CACHE else None
+                            response_text = stale_answer + TEXTS.STALE_ANSWER if stale_answer else TEXTS.SERVICE_UNAVAILABLE
+                            response_metrics = {"degraded": True}
+
+                        # Инструменты превращают отмену в текст ошибки - такой ответ не показываем и не сохраняем
+                        check_cancelled()
+
+                        partial = degraded or response_text == TEXTS.DEADLINE_EXCEEDED or response_text.endswith(TEXTS.PARTIAL_ANSWER)
+                        if semantic_lookup is not None and semantic_lookup.answer is None and not response_text.startswith("Ошибка") and not partial:
+                            semantic_cache.store(semantic_lookup, response_text, time.perf_counter() - turn_started)
+
+                        logger.info("Adding response to session state")
+                        st.session_state.messages.append({"role": "assistant", "content": response_text, "metrics": response_metrics})
                     
-                    logger.info("Displaying response to user")
-                    st.markdown(response_text, unsafe_allow_html=True)
+                        logger.info("Displaying response to user")
+                        st.markdown(response_text, unsafe_allow_html=True)
 
+                except TurnCancelled:
+                    logger.info("Turn superseded by a newer message, dropping its response")
                 except Exception as e:
                     logger.error(f"Error in chat processing: {e}")
                     logger.error(f"Error type: {type(e)}")
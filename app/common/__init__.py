@@ -2,8 +2,7 @@ import os
 import json
 import logging
 import base64
-from sklearn.metrics.pairwise import cosine_similarity
-from gigachat import GigaChat
+import threading
 
 
 def save_file(file_dir, file):
@@ -14,7 +13,13 @@ def save_json(file_dir, file):
   with open(file_dir, 'w') as f:
     json.dump(file, f, ensure_ascii=False, indent=4)
 
+def estimate_tokens(text):
+  # GigaChat в среднем тратит токен на 3 символа русского текста
+  return (len(text) + 2) // 3
+
 def top_k_similar(query_embedding, embeddings, k=5):
+  # sklearn импортируется долго, поэтому загружаем его только при первом вызове
+  from sklearn.metrics.pairwise import cosine_similarity
   scores = []
   for emb in embeddings:
     scores.append(cosine_similarity([query_embedding], [emb]))
@@ -83,28 +88,133 @@ except ValueError as e:
 
 MODEL = os.getenv("MODEL", "GigaChat-Pro-preview")
 SCOPE = os.getenv("SCOPE", "GIGACHAT_API_CORP")
+HTTP2 = os.getenv("HTTP2", "false").lower() == "true"
+SHOW_METRICS = os.getenv("SHOW_METRICS", "false").lower() == "true"
+STREAMING = os.getenv("STREAMING", "true").lower() == "true"
+# Спрашивать у модели намерение, если ни один шаблон команды не подошёл
+ROUTER_CLASSIFIER = os.getenv("ROUTER_CLASSIFIER", "false").lower() == "true"
+RESPONSE_CACHE_DISK = os.getenv("RESPONSE_CACHE_DISK", "false").lower() == "true"
+PDF_CACHE = os.getenv("PDF_CACHE", "true").lower() == "true"
+SEMANTIC_CACHE = os.getenv("SEMANTIC_CACHE", "false").lower() == "true"
+# Дублировать запрос к модели, если ответ задерживается дольше наблюдаемого p95
+HEDGING = os.getenv("HEDGING", "false").lower() == "true"
+EXTRACTIVE_SUMMARY = os.getenv("EXTRACTIVE_SUMMARY", "false").lower() == "true"
+PDF_PREFETCH = os.getenv("PDF_PREFETCH", "false").lower() == "true"
+AUTH_URL = os.getenv("AUTH_URL", "https://ngw.devices.sberbank.ru:9443/api/v2/oauth")
+BASE_URL = os.getenv("BASE_URL", "https://gigachat.devices.sberbank.ru/api/v1")
 try:
     TEMPERATURE = float(os.getenv("TEMPERATURE", "0.1"))
     TIMEOUT = int(os.getenv("TIMEOUT", "600"))
+    # За сколько секунд до истечения токена обновлять его в фоне
+    TOKEN_REFRESH_MARGIN = int(os.getenv("TOKEN_REFRESH_MARGIN", "120"))
+    # Сколько секунд считать список моделей актуальным
+    MODELS_TTL = int(os.getenv("MODELS_TTL", "3600"))
+    # Размер пула keep-alive соединений на один хост и число хостов с собственным пулом
+    HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+    HTTP_POOL_HOSTS = int(os.getenv("HTTP_POOL_HOSTS", "10"))
+    # Допустимое время импорта приложения при холодном старте
+    IMPORT_BUDGET_MS = int(os.getenv("IMPORT_BUDGET_MS", "2000"))
+    # Бюджет токенов на историю диалога в запросе и размер сжатой памяти о старых репликах
+    CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+    SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "300"))
+    # Кэш одинаковых запросов к модели: число записей и время жизни в секундах
+    RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "512"))
+    RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+    # Семантический кэш: размер индекса на маршрут и пороги косинусной близости
+    SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "1000"))
+    SEMANTIC_THRESHOLDS = {
+        "paper_search": float(os.getenv("SEMANTIC_THRESHOLD_SEARCH", "0.92")),
+        "chat": float(os.getenv("SEMANTIC_THRESHOLD_CHAT", "0.96")),
+    }
+    # Сколько асинхронных запросов к GigaChat и файлам выполнять одновременно
+    ASYNC_CONCURRENCY = int(os.getenv("ASYNC_CONCURRENCY", "8"))
+    # Общий лимит на GigaChat: запросов в секунду, токенов в минуту и число повторов при 429/5xx
+    RATE_LIMIT_RPS = float(os.getenv("RATE_LIMIT_RPS", "5"))
+    RATE_LIMIT_TPM = int(os.getenv("RATE_LIMIT_TPM", "100000"))
+    RATE_LIMIT_RETRIES = int(os.getenv("RATE_LIMIT_RETRIES", "3"))
+    # Крайний срок ответа на одну реплику и потолки на стадии: загрузка PDF, разбор PDF, вызов модели
+    TURN_TIMEOUT = float(os.getenv("TURN_TIMEOUT", "120"))
+    DOWNLOAD_TIMEOUT = float(os.getenv("DOWNLOAD_TIMEOUT", "30"))
+    PARSE_TIMEOUT = float(os.getenv("PARSE_TIMEOUT", "30"))
+    LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+    # Клиенты SDK и LangChain срока реплики не видят: их таймаут не больше потолка вызова модели,
+    # иначе брошенные по сроку вызовы держат потоки до TIMEOUT секунд
+    SDK_TIMEOUT = min(TIMEOUT, LLM_TIMEOUT)
+    # Потоки для вызовов SDK с ограничением по сроку реплики: брошенные вызовы дорабатывают в них же
+    BOUNDED_CALL_WORKERS = int(os.getenv("BOUNDED_CALL_WORKERS", "16"))
+    # Сколько замеров задержки нужно, чтобы доверять p95 для дублирующего запроса
+    HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+    # Circuit breaker: окно последних вызовов, доля ошибок для размыкания и пауза до пробного вызова
+    BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))
+    BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))
+    BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))
+    # PDF до этого размера (в байтах) разбирается в памяти, крупнее - через временный файл запроса
+    PDF_SPOOL_SIZE = int(os.getenv("PDF_SPOOL_SIZE", str(20 * 1024 * 1024)))
+    # Больше этого PDF не скачиваем; начиная с PDF_OVERLAP_MIN_SIZE разбор идёт параллельно загрузке
+    PDF_MAX_BYTES = int(os.getenv("PDF_MAX_BYTES", str(50 * 1024 * 1024)))
+    PDF_OVERLAP_MIN_SIZE = int(os.getenv("PDF_OVERLAP_MIN_SIZE", str(2 * 1024 * 1024)))
+    # Процессы для постраничного разбора PDF и минимальное число страниц, с которого пул окупается
+    PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+    PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "24"))
+    # Кэш извлечённого текста PDF: предельный размер на диске и сколько секунд верить записи без перепроверки
+    PDF_CACHE_MAX_BYTES = int(os.getenv("PDF_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+    PDF_CACHE_FRESH = int(os.getenv("PDF_CACHE_FRESH", "86400"))
+    # Предзагрузка PDF из результатов поиска: сколько файлов на сессию и сколько в очереди на весь процесс
+    PDF_PREFETCH_SESSION = int(os.getenv("PDF_PREFETCH_SESSION", "10"))
+    PDF_PREFETCH_PENDING = int(os.getenv("PDF_PREFETCH_PENDING", "6"))
+    # Краткое содержание документа: размер фрагмента в токенах, сколько кратких содержаний сворачивать за раз,
+    # потолок токенов документа, отправляемых модели, и число одновременных запросов по фрагментам
+    DOC_SUMMARY_CHUNK_TOKENS = int(os.getenv("DOC_SUMMARY_CHUNK_TOKENS", "1500"))
+    DOC_SUMMARY_FANOUT = int(os.getenv("DOC_SUMMARY_FANOUT", "4"))
+    DOC_SUMMARY_MAX_TOKENS = int(os.getenv("DOC_SUMMARY_MAX_TOKENS", "30000"))
+    DOC_SUMMARY_CONCURRENCY = int(os.getenv("DOC_SUMMARY_CONCURRENCY", "4"))
+    # До скольких токенов локально сжимать документ отбором ключевых предложений перед суммаризацией
+    EXTRACTIVE_SUMMARY_TOKENS = int(os.getenv("EXTRACTIVE_SUMMARY_TOKENS", "6000"))
+    # Сколько токенов раздела статьи отправлять модели при вопросе по её содержанию
+    PAPER_QA_MAX_TOKENS = int(os.getenv("PAPER_QA_MAX_TOKENS", "4000"))
 except ValueError as e:
     logger.error(f"Error parsing numeric environment variables: {e}")
     raise
 
-try:
-    logger.info("Initializing global GigaChat instance...")
-    giga = GigaChat(
-        credentials=AUTH_DATA,
-        verify_ssl_certs=False,
-        timeout=TIMEOUT,
-        model=MODEL,
-        scope=SCOPE,
-        temperature=TEMPERATURE,
-        auth_url="https://ngw.devices.sberbank.ru:9443/api/v2/oauth"
-    )
-    logger.info("Global GigaChat instance initialized successfully")
-except Exception as e:
-    logger.error(f"Error initializing global GigaChat instance: {e}")
-    raise
+_giga = None
+_giga_lock = threading.Lock()
+
+def get_giga():
+    # Глобальный клиент создаётся при первом обращении: импорт gigachat заметно замедляет холодный старт
+    global _giga
+    if _giga is not None:
+        return _giga
+    with _giga_lock:
+        if _giga is None:
+            try:
+                logger.info("Initializing global GigaChat instance...")
+                from gigachat import GigaChat
+                from app.common.auth import token_manager
+                from app.common.transport import share_pool
+
+                client = GigaChat(
+                    credentials=AUTH_DATA,
+                    verify_ssl_certs=False,
+                    timeout=SDK_TIMEOUT,
+                    model=MODEL,
+                    scope=SCOPE,
+                    temperature=TEMPERATURE,
+                    auth_url=AUTH_URL
+                )
+                token_manager.attach(client)
+                share_pool(client)
+                _giga = client
+                logger.info("Global GigaChat instance initialized successfully")
+            except Exception as e:
+                logger.error(f"Error initializing global GigaChat instance: {e}")
+                raise
+    return _giga
+
+def __getattr__(name):
+    # Позволяет по-прежнему писать `from app.common import giga`
+    if name == "giga":
+        return get_giga()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Промпт для агента
 system_prompt = """
@@ -0,0 +1,92 @@
+import asyncio
+import time
+import weakref
+from app.common import ASYNC_CONCURRENCY, BASE_URL, HTTP_POOL_SIZE, MODEL, SDK_TIMEOUT, TEMPERATURE
+from app.common import metrics
+from app.common.auth import token_manager
+from app.common.cache import key_for_payload, response_cache
+from app.common.completions import build_payload, request_tokens
+from app.common.deadline import LLM, timeout_for
+from app.common.ratelimit import INTERACTIVE, check_response, rate_limiter
+from app.common.resilience import gigachat_breaker
+from app.common.singleflight import chat_flight
+
+
+class AsyncGigaChatClient:
+    """Асинхронный клиент GigaChat для асинхронных запусков инструментов с общим ограничением параллелизма."""
+
+    def __init__(self, concurrency=ASYNC_CONCURRENCY):
+        self.concurrency = concurrency
+        # httpx.AsyncClient и семафор привязаны к event loop, поэтому держим их на каждый loop
+        self._loops = weakref.WeakKeyDictionary()
+
+    def _state(self):
+        import httpx
+
+        loop = asyncio.get_running_loop()
+        state = self._loops.get(loop)
+        if state is None:
+            client = httpx.AsyncClient(
+                base_url=BASE_URL,
+                verify=False,
+                timeout=httpx.Timeout(SDK_TIMEOUT),
+                limits=httpx.Limits(max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_POOL_SIZE),
+            )
+            state = (client, asyncio.Semaphore(self.concurrency))
+            self._loops[loop] = state
+        return state
+
+    async def _headers(self):
+        # Токен почти всегда берётся из кэша, в поток уходим только ради редкого похода в OAuth
+        token = await asyncio.to_thread(token_manager.get_token)
+        return {'Accept': 'application/json', 'Authorization': f'Bearer {token}'}
+
+    async def _request(self, method, url, **kwargs):
+        client, semaphore = self._state()
+        async with semaphore:
+            response = await client.request(method, url, timeout=timeout_for(LLM), **kwargs)
+        return check_response(response, f"GigaChat request to {url} failed")
+
+    async def chat(self, payload, priority=INTERACTIVE):
+        cache_key = key_for_payload(payload)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        return await chat_flight.ado(cache_key, lambda: self._chat(payload, cache_key, priority))
+
+    async def _chat(self, payload, cache_key, priority):
+        started = time.perf_counter()
+        body = {key: value for key, value in payload.items() if value is not None}
+
+        async def request():
+            return await self._request("POST", "/chat/completions", json=body, headers=await self._headers())
+
+        response = await gigachat_breaker.acall(
+            lambda: rate_limiter.acall(request, tokens=request_tokens(payload), priority=priority)
+        )
+        response_data = response.json()
+        if not response_data.get('choices'):
+            raise ValueError("No choices in response")
+        metrics.observe("chat.latency_s", time.perf_counter() - started)
+
+        response_text = response_data['choices'][0]['message']['content']
+        response_cache.put(cache_key, response_text)
+        return response_text
+
+    async def chat_prompt(self, prompt, max_tokens=None, priority=INTERACTIVE):
+        payload = build_payload([{"role": "user", "content": prompt}], TEMPERATURE, max_tokens, model=MODEL)
+        return await self.chat(payload, priority=priority)
+
+    def slot(self):
+        """Семафор текущего event loop для вызовов через сторонние клиенты (например, LangChain)."""
+        return self._state()[1]
+
+    async def aclose(self):
+        state = self._loops.pop(asyncio.get_running_loop(), None)
+        if state is not None:
+            await state[0].aclose()
+
+
+async_client = AsyncGigaChatClient()
+
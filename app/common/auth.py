@@ -0,0 +1,175 @@
+import base64
+import threading
+import time
+import uuid
+import weakref
+from app.common import AUTH_DATA, AUTH_URL, SCOPE, TOKEN_REFRESH_MARGIN, logger
+from app.common.transport import http_session
+
+# Если сервер не вернул срок жизни токена, считаем что он живёт 30 минут
+DEFAULT_TOKEN_TTL = 30 * 60
+# Пауза между повторными попытками фонового обновления после ошибки
+REFRESH_RETRY_DELAY = 10
+
+
+def clean_credentials(credentials):
+    cleaned = credentials.strip().strip('"\'')
+    # Remove 'Basic ' prefix if present
+    if cleaned.startswith('Basic '):
+        cleaned = cleaned[6:]
+
+    try:
+        decoded_token = base64.b64decode(cleaned).decode('utf-8')
+    except Exception as e:
+        logger.error(f"Failed to decode AUTH_DATA: {e}")
+        raise ValueError(f"AUTH_DATA validation failed: {str(e)}")
+
+    # Validate the decoded token format (should be in format client_id:client_secret)
+    client_id, _, client_secret = decoded_token.partition(':')
+    if not client_id or not client_secret:
+        raise ValueError("AUTH_DATA validation failed: decoded token must be in format 'client_id:client_secret'")
+    return cleaned
+
+
+class TokenManager:
+    """Кэш OAuth токенов GigaChat на весь процесс с фоновым обновлением до истечения срока."""
+
+    def __init__(self, auth_url=AUTH_URL, refresh_margin=TOKEN_REFRESH_MARGIN):
+        self.auth_url = auth_url
+        self.refresh_margin = refresh_margin
+        self._tokens = {}
+        self._timers = {}
+        self._clients = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self.default = (AUTH_DATA, SCOPE)
+
+    def configure(self, credentials, scope):
+        """Задаёт учётные данные, которые используют вызовы без явных credentials/scope."""
+        self.default = (credentials, scope)
+
+    def _key(self, credentials, scope):
+        if credentials is None:
+            credentials, scope = self.default
+        return (clean_credentials(credentials), scope)
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _valid(self, entry):
+        return entry is not None and entry["expires_at"] > time.time()
+
+    def get_token(self, credentials=None, scope=None):
+        key = self._key(credentials, scope)
+        entry = self._tokens.get(key)
+        if self._valid(entry):
+            return entry["access_token"]
+
+        # Только один поток ходит за токеном, остальные ждут и берут его из кэша
+        with self._key_lock(key):
+            entry = self._tokens.get(key)
+            if not self._valid(entry):
+                entry = self._fetch(key)
+            return entry["access_token"]
+
+    def expires_at(self, credentials=None, scope=None):
+        entry = self._tokens.get(self._key(credentials, scope))
+        return entry["expires_at"] if entry else None
+
+    def _fetch(self, key):
+        credentials, scope = key
+        logger.info(f"Requesting access token for scope {scope}...")
+
+        auth_response = http_session.post(
+            self.auth_url,
+            headers={
+                'Content-Type': 'application/x-www-form-urlencoded',
+                'Accept': 'application/json',
+                'RqUID': str(uuid.uuid4()),
+                'Authorization': f'Basic {credentials}'
+            },
+            data={'scope': scope},
+            verify=False,
+            timeout=30
+        )
+        logger.info(f"Auth response status: {auth_response.status_code}")
+
+        if auth_response.status_code != 200:
+            error_msg = f"Failed to get access token. Status code: {auth_response.status_code}"
+            if auth_response.text:
+                try:
+                    error_data = auth_response.json()
+                    error_msg += f", Error code: {error_data.get('code')}, Message: {error_data.get('message')}"
+                except Exception:
+                    error_msg += f", Response: {auth_response.text}"
+            raise ValueError(error_msg)
+
+        try:
+            response_data = auth_response.json()
+        except Exception as e:
+            logger.error(f"Failed to parse access token from response: {e}")
+            raise ValueError(f"Invalid response format: {auth_response.text}")
+
+        access_token = response_data.get('access_token')
+        if not access_token:
+            raise ValueError("Access token not found in response")
+
+        # ngw отдаёт expires_at в миллисекундах, некоторые прокси - expires_in в секундах
+        if response_data.get('expires_at'):
+            expires_at = response_data['expires_at'] / 1000
+        elif response_data.get('expires_in'):
+            expires_at = time.time() + float(response_data['expires_in'])
+        else:
+            expires_at = time.time() + DEFAULT_TOKEN_TTL
+        logger.info(f"Token will expire in {int(expires_at - time.time())} seconds")
+
+        entry = {"access_token": access_token, "expires_at": expires_at}
+        self._tokens[key] = entry
+        self._push(key, entry)
+        self._schedule_refresh(key, max(expires_at - time.time() - self.refresh_margin, 0))
+        return entry
+
+    def _schedule_refresh(self, key, delay):
+        with self._lock:
+            timer = self._timers.get(key)
+            if timer is not None:
+                timer.cancel()
+            timer = threading.Timer(delay, self._refresh, args=(key,))
+            timer.daemon = True
+            self._timers[key] = timer
+            timer.start()
+
+    def _refresh(self, key):
+        try:
+            with self._key_lock(key):
+                self._fetch(key)
+            logger.info(f"Access token for scope {key[1]} refreshed in background")
+        except Exception as e:
+            logger.error(f"Background token refresh failed: {e}")
+            entry = self._tokens.get(key)
+            if self._valid(entry):
+                self._schedule_refresh(key, REFRESH_RETRY_DELAY)
+
+    def attach(self, client, credentials=None, scope=None):
+        """Подписывает клиент gigachat на токен: при каждом обновлении он получает новый без своего похода в OAuth."""
+        key = self._key(credentials, scope)
+        with self._lock:
+            self._clients.setdefault(key, weakref.WeakSet()).add(client)
+        self.get_token(*key)
+        self._push(key, self._tokens[key])
+        return client
+
+    def _push(self, key, entry):
+        from gigachat.models import AccessToken
+
+        with self._lock:
+            clients = list(self._clients.get(key, ()))
+        for client in clients:
+            client._access_token = AccessToken(
+                access_token=entry["access_token"],
+                expires_at=int(entry["expires_at"] * 1000)
+            )
+
+
+token_manager = TokenManager()
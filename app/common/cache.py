@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from app.common import DATA_PATH, RESPONSE_CACHE_DISK, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, logger
+from app.common import metrics
+
+
+def _normalize(text):
+    return " ".join(str(text).split()).casefold()
+
+
+def make_key(model, system_prompt, messages, temperature, max_tokens):
+    # Системный промпт длинный, поэтому в ключ попадает только его хэш
+    system_hash = hashlib.sha256((system_prompt or "").encode("utf-8")).hexdigest()
+    normalized = {
+        "model": model,
+        "system": system_hash,
+        "messages": [(message["role"], _normalize(message["content"])) for message in messages],
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+    }
+    return hashlib.sha256(json.dumps(normalized, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def key_for_payload(payload):
+    messages = payload["messages"]
+    system_prompt = "".join(m["content"] for m in messages if m["role"] == "system")
+    return make_key(
+        payload["model"],
+        system_prompt,
+        [m for m in messages if m["role"] != "system"],
+        payload.get("temperature"),
+        payload.get("max_tokens"),
+    )
+
+
+class ResponseCache:
+    """LRU кэш ответов модели с TTL в памяти и необязательным уровнем на диске."""
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL, disk_path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_path = disk_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if disk_path and not os.path.exists(disk_path):
+            os.makedirs(disk_path)
+
+    def _disk_file(self, key):
+        return os.path.join(self.disk_path, key[:2], f"{key}.json")
+
+    def _read_disk(self, key):
+        path = self._disk_file(key)
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry["stored_at"] > self.ttl:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return entry
+
+    def _write_disk(self, key, entry):
+        path = self._disk_file(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f"Failed to write response cache entry: {e}")
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry["stored_at"] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                metrics.incr("response_cache.hits")
+                return entry["value"]
+
+        entry = self._read_disk(key) if self.disk_path else None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                metrics.incr("response_cache.misses")
+                return None
+            self.disk_hits += 1
+            metrics.incr("response_cache.disk_hits")
+            self._store(key, entry)
+            return entry["value"]
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def put(self, key, value):
+        entry = {"value": value, "stored_at": time.time()}
+        with self._lock:
+            self._store(key, entry)
+        if self.disk_path:
+            self._write_disk(key, entry)
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.disk_hits) / lookups, 3) if lookups else None,
+        }
+
+
+response_cache = ResponseCache(
+    disk_path=os.path.join(DATA_PATH, "response_cache") if RESPONSE_CACHE_DISK else None
+)
+metrics.register("response_cache", response_cache.stats)
@@ -0,0 +1,137 @@
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+from app.common import BASE_URL, MODELS_TTL, logger
+from app.common.auth import token_manager
+from app.common.ratelimit import BATCH, check_response, rate_limiter
+from app.common.transport import http_session
+
+# /models не отдаёт размеры контекста, поэтому берём их из документации GigaChat
+KNOWN_CAPABILITIES = {
+    "GigaChat": (32768, 2048),
+    "GigaChat-Plus": (32768, 2048),
+    "GigaChat-Pro": (32768, 2048),
+    "GigaChat-Max": (32768, 2048),
+    "GigaChat-2": (131072, 4096),
+    "GigaChat-2-Pro": (131072, 4096),
+    "GigaChat-2-Max": (131072, 4096),
+}
+DEFAULT_CAPABILITIES = (32768, 2048)
+
+
+@dataclass(frozen=True)
+class ModelInfo:
+    id: str
+    type: str
+    owned_by: str
+    context_length: int
+    max_output_tokens: int
+
+
+def _capabilities(model_id):
+    # "GigaChat-Pro-preview" имеет те же лимиты, что и "GigaChat-Pro"
+    base = model_id[:-len("-preview")] if model_id.endswith("-preview") else model_id
+    return KNOWN_CAPABILITIES.get(base, DEFAULT_CAPABILITIES)
+
+
+class ModelCatalog:
+    """Список моделей GigaChat с TTL: читается без блокировки, обновляется в фоне."""
+
+    def __init__(self, ttl=MODELS_TTL):
+        self.ttl = ttl
+        self._credentials = None
+        self._scope = None
+        self._models: Dict[str, ModelInfo] = {}
+        self._loaded_at = 0.0
+        self._refreshing = False
+        self._loaded = threading.Event()
+        self._lock = threading.Lock()
+
+    def bind(self, credentials, scope):
+        self._credentials = credentials
+        self._scope = scope
+        self._maybe_refresh()
+
+    @property
+    def stale(self):
+        return time.time() - self._loaded_at > self.ttl
+
+    def _maybe_refresh(self):
+        if not self.stale or self._credentials is None:
+            return
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, name="model-catalog-refresh", daemon=True).start()
+
+    def _refresh(self):
+        try:
+            self._models = self._fetch()
+            self._loaded_at = time.time()
+            self._loaded.set()
+            logger.info(f"Model catalog refreshed: {', '.join(self._models)}")
+        except Exception as e:
+            logger.error(f"Failed to refresh model catalog: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _fetch(self):
+        def get_models():
+            models_response = http_session.get(
+                f"{BASE_URL}/models",
+                headers={
+                    'Accept': 'application/json',
+                    'Authorization': f'Bearer {token_manager.get_token(self._credentials, self._scope)}'
+                },
+                verify=False,
+                timeout=30
+            )
+            logger.info(f"Models response status: {models_response.status_code}")
+            return check_response(models_response, "Failed to get models")
+
+        # Повторы при 429 с учётом Retry-After делает общий limiter
+        models_response = rate_limiter.call(get_models, priority=BATCH)
+
+        models = {}
+        for item in models_response.json().get('data', []):
+            context_length, max_output_tokens = _capabilities(item['id'])
+            models[item['id']] = ModelInfo(
+                id=item['id'],
+                type=item.get('type', 'chat'),
+                owned_by=item.get('owned_by', ''),
+                context_length=item.get('context_length', context_length),
+                max_output_tokens=item.get('max_output_tokens', max_output_tokens),
+            )
+        return models
+
+    def wait_loaded(self, timeout=None):
+        return self._loaded.wait(timeout)
+
+    def models(self):
+        self._maybe_refresh()
+        return dict(self._models)
+
+    def get(self, model) -> Optional[ModelInfo]:
+        self._maybe_refresh()
+        return self._models.get(model)
+
+    def is_available(self, model) -> Optional[bool]:
+        """True/False, если каталог уже загружен, и None, пока первая загрузка ещё идёт."""
+        self._maybe_refresh()
+        if not self._loaded.is_set():
+            return None
+        return model in self._models
+
+    def capabilities(self, model) -> ModelInfo:
+        # Пока каталог не загружен, отдаём известные лимиты, чтобы не ждать сеть
+        info = self.get(model)
+        if info is not None:
+            return info
+        context_length, max_output_tokens = _capabilities(model)
+        return ModelInfo(model, 'chat', '', context_length, max_output_tokens)
+
+
+model_catalog = ModelCatalog()
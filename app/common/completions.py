@@ -0,0 +1,248 @@
+import json
+import time
+from app.common import BASE_URL, MODEL, TEMPERATURE, estimate_tokens, logger
+from app.common import metrics
+from app.common.auth import token_manager
+from app.common.cache import key_for_payload, response_cache
+from app.common.deadline import LLM, bounded, check as check_deadline, timeout_for
+from app.common.ratelimit import INTERACTIVE, check_response, rate_limiter
+from app.common.resilience import gigachat_breaker, hedged
+from app.common.singleflight import LeaderAbandoned, chat_flight
+from app.common.transport import http_session
+
+CHAT_URL = f"{BASE_URL}/chat/completions"
+
+
+def build_payload(messages, temperature, max_tokens, model=MODEL):
+    return {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens
+    }
+
+
+def request_tokens(payload):
+    # Оценка расхода бюджета токенов в минуту: промпт плюс максимальная длина ответа
+    prompt_tokens = sum(estimate_tokens(message["content"]) for message in payload["messages"])
+    return prompt_tokens + (payload.get("max_tokens") or 512)
+
+
+def _post(payload, stream, timeout):
+    chat_headers = {
+        'Content-Type': 'application/json',
+        'Accept': 'text/event-stream' if stream else 'application/json',
+        'Authorization': f'Bearer {token_manager.get_token()}'
+    }
+    logger.info(f"Sending request to GigaChat API (stream={stream}, messages={len(payload['messages'])})")
+
+    chat_response = http_session.post(
+        CHAT_URL,
+        headers=chat_headers,
+        json=dict(payload, stream=stream),
+        verify=False,
+        timeout=timeout,
+        stream=stream
+    )
+    logger.info(f"Chat response status: {chat_response.status_code}")
+    return check_response(chat_response, "Failed to get chat completion")
+
+
+def complete(payload, timeout=None, priority=INTERACTIVE):
+    cache_key = key_for_payload(payload)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        logger.info("Serving chat completion from cache")
+        return cached
+
+    # Одинаковые запросы из разных сессий, пришедшие одновременно, делят один вызов
+    return chat_flight.do(
+        cache_key,
+        lambda: _complete(payload, cache_key, timeout, priority),
+        timeout=timeout_for(LLM, timeout)
+    )
+
+
+def _complete(payload, cache_key, timeout, priority):
+    started = time.perf_counter()
+    # Дубль запроса при долгом ответе тратит лимит, поэтому фоновые вызовы не дублируем
+    chat_response = gigachat_breaker.call(lambda: hedged(
+        lambda: rate_limiter.call(
+            lambda: _post(payload, stream=False, timeout=timeout_for(LLM, timeout)),
+            tokens=request_tokens(payload),
+            priority=priority
+        ),
+        "chat.latency_s",
+        enabled=priority == INTERACTIVE
+    ))
+    response_data = chat_response.json()
+    if not response_data.get('choices'):
+        raise ValueError("No choices in response")
+
+    metrics.observe("chat.latency_s", time.perf_counter() - started)
+    response_text = response_data['choices'][0]['message']['content']
+    logger.info(f"Response length: {len(response_text)}")
+    response_cache.put(cache_key, response_text)
+    return response_text
+
+
+def giga_chat(prompt, max_tokens=None, priority=INTERACTIVE):
+    """Ответ глобального клиента gigachat на одиночный промпт, через общий кэш ответов."""
+    payload = build_payload([{"role": "user", "content": prompt}], TEMPERATURE, max_tokens)
+    cache_key = key_for_payload(payload)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    return chat_flight.do(
+        cache_key,
+        lambda: _giga_chat(payload, cache_key, max_tokens, priority),
+        timeout=timeout_for(LLM)
+    )
+
+
+def _giga_chat(payload, cache_key, max_tokens, priority):
+    from app.common import giga
+
+    started = time.perf_counter()
+    chat = {"messages": payload["messages"], "temperature": TEMPERATURE}
+    if max_tokens:
+        chat["max_tokens"] = max_tokens
+    # У SDK таймаут задаётся на весь клиент, поэтому дедлайн реплики соблюдаем ожиданием с таймаутом
+    response = gigachat_breaker.call(lambda: hedged(
+        lambda: rate_limiter.call(
+            lambda: bounded(lambda: giga.chat(chat), LLM),
+            tokens=request_tokens(payload),
+            priority=priority
+        ),
+        "giga.latency_s",
+        enabled=priority == INTERACTIVE
+    ))
+    response_text = response.choices[0].message.content
+    metrics.observe("giga.latency_s", time.perf_counter() - started)
+    response_cache.put(cache_key, response_text)
+    return response_text
+
+
+class StreamStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.first_token_at = None
+        self.finished_at = None
+        self.chunks = 0
+        self.completion_tokens = None
+        self.cached = False
+        self.coalesced = False
+
+    @property
+    def ttft(self):
+        return self.first_token_at - self.started if self.first_token_at else None
+
+    @property
+    def tokens(self):
+        # Если сервер не прислал usage, считаем каждый чанк одним токеном
+        return self.completion_tokens if self.completion_tokens is not None else self.chunks
+
+    @property
+    def tokens_per_second(self):
+        if not self.first_token_at or not self.finished_at or self.finished_at <= self.first_token_at:
+            return None
+        return self.tokens / (self.finished_at - self.first_token_at)
+
+    def as_dict(self):
+        return {
+            "ttft_s": round(self.ttft, 3) if self.ttft is not None else None,
+            "tokens": self.tokens,
+            "tokens_per_second": round(self.tokens_per_second, 1) if self.tokens_per_second else None,
+            "cached": self.cached,
+            "coalesced": self.coalesced,
+        }
+
+
+def stream(payload, stats=None, timeout=None):
+    """Отдаёт текст ответа по мере генерации (SSE), заполняя stats временем до первого токена и скоростью."""
+    stats = stats if stats is not None else StreamStats()
+    cache_key = key_for_payload(payload)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        stats.first_token_at = stats.finished_at = time.perf_counter()
+        stats.cached = True
+        yield cached
+        return
+
+    while True:
+        call, leader = chat_flight.begin(cache_key)
+        if leader:
+            break
+        try:
+            # Такой же ответ уже генерируется для другой сессии - дожидаемся его целиком
+            response_text = call.wait(timeout_for(LLM, timeout))
+        except LeaderAbandoned:
+            # Реплику лидера отменили или она не уложилась в свой срок - генерируем ответ сами
+            continue
+        stats.first_token_at = stats.finished_at = time.perf_counter()
+        stats.coalesced = True
+        yield response_text
+        return
+
+    parts = []
+    completed = False
+    interrupted = None
+    try:
+        # Для потока дублируем только открытие соединения, лишний ответ закрываем
+        chat_response = gigachat_breaker.call(lambda: hedged(
+            lambda: rate_limiter.call(
+                lambda: _post(payload, stream=True, timeout=timeout_for(LLM, timeout)),
+                tokens=request_tokens(payload)
+            ),
+            "chat.open_s",
+            discard=lambda response: response.close()
+        ))
+        metrics.observe("chat.open_s", time.perf_counter() - stats.started)
+    except BaseException as e:
+        chat_flight.finish(cache_key, call, error=e)
+        raise
+
+    try:
+        for line in chat_response.iter_lines(decode_unicode=True):
+            # Таймаут requests ограничивает только паузу между чанками, общий срок проверяем сами
+            check_deadline(LLM)
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+
+            chunk = json.loads(data)
+            if chunk.get("usage"):
+                stats.completion_tokens = chunk["usage"].get("completion_tokens")
+            for choice in chunk.get("choices", []):
+                delta = choice.get("delta", {}).get("content")
+                if delta:
+                    if stats.first_token_at is None:
+                        stats.first_token_at = time.perf_counter()
+                    stats.chunks += 1
+                    parts.append(delta)
+                    yield delta
+        completed = True
+    except BaseException as e:
+        # Закрытие генератора, отмена и дедлайн реплики ожидающим не передаются, ошибки upstream - передаются
+        interrupted = e
+        raise
+    finally:
+        chat_response.close()
+        if completed:
+            # В кэш попадают только полностью полученные ответы, до снятия блокировки single-flight
+            if parts:
+                response_cache.put(cache_key, "".join(parts))
+            chat_flight.finish(cache_key, call, result="".join(parts))
+        else:
+            error = interrupted or ValueError("Chat completion stream was interrupted")
+            chat_flight.finish(cache_key, call, error=error)
+        stats.finished_at = time.perf_counter()
+        if stats.ttft is not None:
+            metrics.observe("chat.ttft_s", stats.ttft)
+            metrics.observe("chat.latency_s", stats.finished_at - stats.started)
+        if stats.tokens_per_second:
+            metrics.observe("chat.tokens_per_second", stats.tokens_per_second)
+        logger.info(f"Stream finished: {stats.as_dict()}")
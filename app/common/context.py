@@ -0,0 +1,91 @@
+from app.common import CONTEXT_TOKEN_BUDGET, SUMMARY_MAX_TOKENS, estimate_tokens, logger
+from app.common import metrics
+from app.common.completions import build_payload, complete
+from app.common.ratelimit import BATCH
+
+# Служебные токены на каждое сообщение (роль, разделители)
+MESSAGE_OVERHEAD = 4
+
+SUMMARY_PROMPT = """Ниже краткое содержание начала диалога с ИИ-ассистентом и новые реплики.
+Обнови краткое содержание так, чтобы в нём остались темы, найденные статьи, ссылки и выводы.
+Пиши сжато, не более {max_tokens} токенов.
+
+Краткое содержание:
+{summary}
+
+Новые реплики:
+{turns}"""
+
+
+def _cost(message):
+    return estimate_tokens(message["content"]) + MESSAGE_OVERHEAD
+
+
+class ConversationContext:
+    """Собирает историю диалога в бюджет токенов, сворачивая вышедшие из окна реплики в краткую память."""
+
+    def __init__(self, memory, budget=CONTEXT_TOKEN_BUDGET, summary_max_tokens=SUMMARY_MAX_TOKENS):
+        # memory - dict из st.session_state, переживает перезапуски скрипта
+        self.memory = memory
+        self.memory.setdefault("summary", "")
+        self.memory.setdefault("summarized_upto", 0)
+        self.budget = budget
+        self.summary_max_tokens = summary_max_tokens
+
+    def _summarize(self, turns):
+        turns_text = "\n".join(f"{msg['role']}: {msg['content']}" for msg in turns)
+        payload = build_payload(
+            [{"role": "user", "content": SUMMARY_PROMPT.format(
+                max_tokens=self.summary_max_tokens,
+                summary=self.memory["summary"] or "(пусто)",
+                turns=turns_text,
+            )}],
+            temperature=0.1,
+            max_tokens=self.summary_max_tokens
+        )
+        # Сжатие истории - фоновая работа, она не должна отнимать бюджет у ответов пользователю
+        return complete(payload, priority=BATCH)
+
+    def build(self, system_prompt, history, prompt):
+        summarized_upto = self.memory["summarized_upto"]
+        available = (
+            self.budget
+            - estimate_tokens(system_prompt)
+            - self.summary_max_tokens
+            - estimate_tokens(prompt)
+            - MESSAGE_OVERHEAD * 2
+        )
+
+        # Берём самые свежие реплики, пока они помещаются в бюджет
+        window_start = len(history)
+        used = 0
+        for index in range(len(history) - 1, summarized_upto - 1, -1):
+            cost = _cost(history[index])
+            if used + cost > available:
+                break
+            used += cost
+            window_start = index
+
+        # В краткую память уходят только реплики, которые выпали из окна с прошлого раза
+        if window_start > summarized_upto:
+            dropped = history[summarized_upto:window_start]
+            try:
+                self.memory["summary"] = self._summarize(dropped)
+                self.memory["summarized_upto"] = window_start
+                metrics.incr("context.summarized_turns", len(dropped))
+                logger.info(f"Summarized {len(dropped)} turns into conversation memory")
+            except Exception as e:
+                logger.error(f"Failed to summarize conversation history: {e}")
+
+        system_content = system_prompt
+        if self.memory["summary"]:
+            system_content += f"\n\nКраткое содержание предыдущей части диалога:\n{self.memory['summary']}"
+
+        messages = [{"role": "system", "content": system_content}]
+        messages += [{"role": msg["role"], "content": msg["content"]} for msg in history[window_start:]]
+        messages.append({"role": "user", "content": prompt})
+
+        total = sum(_cost(message) for message in messages)
+        metrics.observe("context.request_tokens", total)
+        logger.info(f"Context: {len(messages)} messages, ~{total} tokens, {self.memory['summarized_upto']} turns in memory")
+        return messages
@@ -0,0 +1,171 @@
+import contextlib
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from app.common import BOUNDED_CALL_WORKERS, DOWNLOAD_TIMEOUT, LLM_TIMEOUT, PARSE_TIMEOUT, TURN_TIMEOUT, logger
+from app.common import metrics
+
+DOWNLOAD = "download"
+PARSE = "parse"
+LLM = "llm"
+
+STAGE_BUDGETS = {
+    DOWNLOAD: DOWNLOAD_TIMEOUT,
+    PARSE: PARSE_TIMEOUT,
+    LLM: LLM_TIMEOUT,
+}
+
+# Дедлайн текущей реплики. ContextVar копируется в asyncio-задачи и asyncio.to_thread,
+# поэтому клиенты получают его без явной передачи через все вызовы
+_current = contextvars.ContextVar("deadline", default=None)
+
+# Для SDK-клиентов, у которых нельзя задать таймаут на отдельный вызов. Отдельно от пула HTTP-соединений:
+# брошенные по сроку вызовы занимают поток, пока не завершатся
+_executor = ThreadPoolExecutor(max_workers=BOUNDED_CALL_WORKERS, thread_name_prefix="bounded-sdk")
+# Как часто ожидающий код проверяет, не отменена ли реплика
+CANCEL_POLL_INTERVAL = 0.2
+
+
+class DeadlineExceeded(TimeoutError):
+    def __init__(self, stage=None):
+        super().__init__(f"Turn deadline exceeded{f' during {stage}' if stage else ''}")
+        self.stage = stage
+
+
+class TurnCancelled(RuntimeError):
+    def __init__(self):
+        super().__init__("Turn was superseded by a newer message")
+
+
+def is_turn_scoped(error):
+    """Ошибка касается только этой реплики (отмена, срок, выход из генератора, отмена задачи), а не upstream."""
+    return isinstance(error, (TurnCancelled, DeadlineExceeded)) or not isinstance(error, Exception)
+
+
+class Deadline:
+    """Крайний срок ответа на реплику пользователя и её токен отмены."""
+
+    def __init__(self, seconds=TURN_TIMEOUT, superseded=None):
+        self.seconds = seconds
+        self.started = time.monotonic()
+        self.expires_at = self.started + seconds
+        # superseded - необязательная проверка, не пришло ли в сессию новое сообщение
+        self._superseded = superseded
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        if not self._cancelled.is_set():
+            self._cancelled.set()
+            metrics.incr("deadline.cancelled_turns")
+            logger.info("Cancelling outstanding work of a superseded turn")
+
+    @property
+    def cancelled(self):
+        if not self._cancelled.is_set() and self._superseded is not None:
+            try:
+                if self._superseded():
+                    self.cancel()
+            except Exception as e:
+                logger.error(f"Turn supersede check failed: {e}")
+                self._superseded = None
+        return self._cancelled.is_set()
+
+    def remaining(self):
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    @property
+    def expired(self):
+        return time.monotonic() >= self.expires_at
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+
+@contextlib.contextmanager
+def turn_deadline(seconds=TURN_TIMEOUT, superseded=None):
+    deadline = Deadline(seconds, superseded)
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    except BaseException:
+        # Реплику прервали (в том числе перезапуском скрипта Streamlit) - фоновая работа ей больше не нужна
+        deadline.cancel()
+        raise
+    finally:
+        _current.reset(token)
+        metrics.observe("deadline.turn_s", deadline.elapsed)
+
+
+def current():
+    return _current.get()
+
+
+def timeout_for(stage, default=None):
+    """Таймаут для очередного вызова стадии: не больше её потолка и остатка времени реплики."""
+    budget = STAGE_BUDGETS[stage] if default is None else min(default, STAGE_BUDGETS[stage])
+    deadline = _current.get()
+    if deadline is None:
+        return budget
+    if deadline.cancelled:
+        raise TurnCancelled()
+    remaining = deadline.remaining()
+    if remaining <= 0:
+        metrics.incr(f"deadline.exceeded.{stage}")
+        raise DeadlineExceeded(stage)
+    return min(budget, remaining)
+
+
+def check_cancelled():
+    deadline = _current.get()
+    if deadline is not None and deadline.cancelled:
+        raise TurnCancelled()
+
+
+def check(stage=None):
+    check_cancelled()
+    deadline = _current.get()
+    if deadline is not None and deadline.expired:
+        metrics.incr(f"deadline.exceeded.{stage or 'turn'}")
+        raise DeadlineExceeded(stage)
+
+
+def sleep(seconds):
+    """time.sleep, который просыпается при отмене реплики."""
+    wake_at = time.monotonic() + seconds
+    while True:
+        check_cancelled()
+        left = wake_at - time.monotonic()
+        if left <= 0:
+            return
+        time.sleep(min(left, CANCEL_POLL_INTERVAL))
+
+
+def bounded(fn, stage=LLM):
+    """Вызывает fn, не дожидаясь его дольше таймаута стадии. Брошенный вызов дорабатывает в фоне."""
+    deadline = _current.get()
+    if deadline is None:
+        return fn()
+    timeout = timeout_for(stage)
+    wait_until = time.monotonic() + timeout
+    # Вызов выполняется в копии контекста реплики: брошенный, он видит её отмену и срок
+    future = _executor.submit(contextvars.copy_context().run, fn)
+    while True:
+        try:
+            return future.result(timeout=min(CANCEL_POLL_INTERVAL, max(wait_until - time.monotonic(), 0.0)))
+        except FutureTimeoutError:
+            if deadline.cancelled:
+                _abandon(future)
+                raise TurnCancelled() from None
+            if time.monotonic() >= wait_until:
+                logger.warning(f"Stopped waiting for {stage} call after {timeout:.1f}s")
+                metrics.incr(f"deadline.exceeded.{stage}")
+                _abandon(future)
+                raise DeadlineExceeded(stage) from None
+
+
+def _abandon(future):
+    # Ещё не начатый вызов снимаем с очереди, начатый дорабатывает в фоне
+    if not future.cancel():
+        metrics.incr("deadline.abandoned_calls")
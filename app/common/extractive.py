@@ -0,0 +1,148 @@
+import re
+import time
+from collections import Counter
+import numpy as np
+from app.common import estimate_tokens, logger
+from app.common import metrics
+
+# Сокращения, после точки в которых предложение не заканчивается
+ABBREVIATIONS = {
+    "т", "е", "д", "п", "др", "пр", "см", "ср", "рис", "табл", "гл", "разд", "стр", "с", "г", "гг", "в", "вв",
+    "им", "проф", "акад", "доц", "канд", "докт", "наук", "ред", "изд", "вып", "англ", "лат", "напр", "т.е",
+    "т.к", "т.д", "т.п", "и.о", "etc", "e.g", "i.e", "fig", "et", "al", "vol", "no", "pp", "eq",
+}
+STOPWORDS = {
+    "и", "в", "во", "не", "что", "он", "на", "я", "с", "со", "как", "а", "то", "все", "она", "так", "его", "но",
+    "да", "ты", "к", "у", "же", "вы", "за", "бы", "по", "только", "ее", "её", "мне", "было", "вот", "от", "меня",
+    "еще", "ещё", "нет", "о", "из", "ему", "теперь", "когда", "даже", "ну", "ли", "если", "уже", "или", "ни",
+    "быть", "был", "него", "до", "вас", "нибудь", "опять", "уж", "вам", "ведь", "там", "потом", "себя", "ничего",
+    "ей", "может", "они", "тут", "где", "есть", "надо", "ней", "для", "мы", "тебя", "их", "чем", "была", "сам",
+    "чтоб", "без", "будто", "чего", "раз", "тоже", "себе", "под", "будет", "ж", "тогда", "кто", "этот", "того",
+    "потому", "этого", "какой", "совсем", "ним", "здесь", "этом", "один", "почти", "мой", "тем", "чтобы", "нее",
+    "были", "куда", "зачем", "всех", "никогда", "можно", "при", "наконец", "два", "об", "другой", "хоть",
+    "после", "над", "больше", "тот", "через", "эти", "нас", "про", "всего", "них", "какая", "много", "разве",
+    "три", "эту", "моя", "впрочем", "хорошо", "свою", "этой", "перед", "иногда", "лучше", "чуть", "том",
+    "нельзя", "такой", "им", "более", "всегда", "конечно", "всю", "между", "это", "также", "которые",
+    "который", "которая", "которое", "которых", "является", "являются", "данной", "данный", "статье", "работе",
+    "the", "and", "of", "to", "in", "is", "for", "that", "with", "on", "as", "by", "are", "this", "an", "be",
+}
+# Длина основы слова: грубая замена стеммеру, которой для русского языка хватает для подсчёта терминов
+STEM_LENGTH = 6
+# Предложения короче этого числа терминов (заголовки, подписи, номера) не выбираются
+MIN_SENTENCE_TERMS = 4
+# Ограничения размера матриц: словарь и число предложений для TextRank
+MAX_TERMS = 4000
+MAX_TEXTRANK_SENTENCES = 2500
+DAMPING = 0.85
+
+# Конец предложения: знак препинания, закрывающие кавычки и скобки, затем пробел
+_SENTENCE_END = re.compile(r"[.!?…]+[\"»”)\]]*\s+")
+_WORD = re.compile(r"[^\W\d_]+(?:-[^\W\d_]+)*")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def split_sentences(text):
+    """Делит текст на предложения с учётом русских сокращений и инициалов."""
+    text = _WHITESPACE.sub(" ", text).strip()
+    sentences = []
+    start = 0
+    for match in _SENTENCE_END.finditer(text):
+        end = match.end()
+        if end >= len(text):
+            break
+        following = text[end]
+        if not (following.isupper() or following.isdigit() or following in "«\"—–-(["):
+            continue
+        word = text[start:match.start()].rsplit(" ", 1)[-1].lower()
+        # Инициалы ("А. С. Пушкин") и сокращения ("рис. 2", "и т. д.") не заканчивают предложение
+        if (len(word) == 1 and word.isalpha()) or word.lstrip("(«\"") in ABBREVIATIONS:
+            continue
+        sentences.append(text[start:match.end()].strip())
+        start = end
+    tail = text[start:].strip()
+    if tail:
+        sentences.append(tail)
+    return sentences
+
+
+def _terms(sentence):
+    return [
+        word[:STEM_LENGTH] for word in _WORD.findall(sentence.lower())
+        if len(word) > 2 and word not in STOPWORDS
+    ]
+
+
+def _tfidf(sentence_terms):
+    df = Counter(term for terms in sentence_terms for term in set(terms))
+    # Термин из одного предложения не связывает его с другими, а встречающийся везде ничего не различает
+    candidates = [term for term, count in df.items() if 1 < count < len(sentence_terms)] or list(df)
+    vocabulary = {term: column for column, term in enumerate(sorted(candidates, key=df.get, reverse=True)[:MAX_TERMS])}
+
+    matrix = np.zeros((len(sentence_terms), len(vocabulary)), dtype=np.float32)
+    for row, terms in enumerate(sentence_terms):
+        for term in terms:
+            column = vocabulary.get(term)
+            if column is not None:
+                matrix[row, column] += 1.0
+    idf = np.array([df[term] for term in vocabulary], dtype=np.float32)
+    idf = np.log((1.0 + len(sentence_terms)) / (1.0 + idf)) + 1.0
+    matrix = np.log1p(matrix) * idf
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+
+def _textrank(matrix, iterations=50, tolerance=1e-6):
+    similarity = matrix @ matrix.T
+    np.fill_diagonal(similarity, 0.0)
+    row_sums = similarity.sum(axis=1, keepdims=True)
+    transition = np.divide(similarity, row_sums, out=np.zeros_like(similarity), where=row_sums > 0)
+    count = matrix.shape[0]
+    scores = np.full(count, 1.0 / count, dtype=np.float32)
+    for _ in range(iterations):
+        updated = (1.0 - DAMPING) / count + DAMPING * (transition.T @ scores)
+        if np.abs(updated - scores).sum() < tolerance:
+            return updated
+        scores = updated
+    return scores
+
+
+def score_sentences(sentence_terms):
+    matrix = _tfidf(sentence_terms)
+    if matrix.shape[1] == 0:
+        return np.zeros(len(sentence_terms), dtype=np.float32)
+    if len(sentence_terms) <= MAX_TEXTRANK_SENTENCES:
+        return _textrank(matrix)
+    # Для очень длинных документов матрица похожести слишком велика - сравниваем с центроидом документа
+    return matrix @ matrix.mean(axis=0)
+
+
+def extract_key_sentences(text, max_tokens):
+    """Самые информативные предложения текста в пределах max_tokens, в исходном порядке."""
+    total_tokens = estimate_tokens(text)
+    if total_tokens <= max_tokens:
+        return text
+
+    started = time.perf_counter()
+    sentences = split_sentences(text)
+    sentence_terms = [_terms(sentence) for sentence in sentences]
+    scores = score_sentences(sentence_terms)
+
+    selected = []
+    used = 0
+    for index in np.argsort(-scores, kind="stable"):
+        if len(sentence_terms[index]) < MIN_SENTENCE_TERMS:
+            continue
+        cost = estimate_tokens(sentences[index]) + 1
+        if used + cost <= max_tokens:
+            selected.append(index)
+            used += cost
+
+    result = " ".join(sentences[index] for index in sorted(selected))
+    elapsed = time.perf_counter() - started
+    metrics.observe("extractive.latency_s", elapsed)
+    metrics.incr("extractive.saved_tokens", total_tokens - estimate_tokens(result))
+    logger.info(
+        f"Extracted {len(selected)} of {len(sentences)} sentences: "
+        f"~{total_tokens} -> ~{estimate_tokens(result)} tokens in {elapsed:.3f}s"
+    )
+    return result
@@ -0,0 +1,59 @@
+import threading
+from collections import defaultdict, deque
+
+# Для распределений храним последние значения, этого достаточно для p50/p95
+WINDOW_SIZE = 500
+
+_counters = defaultdict(float)
+_observations = defaultdict(lambda: deque(maxlen=WINDOW_SIZE))
+_sources = {}
+_lock = threading.Lock()
+
+
+def incr(name, value=1):
+    with _lock:
+        _counters[name] += value
+
+
+def observe(name, value):
+    with _lock:
+        _observations[name].append(value)
+
+
+def count(name):
+    with _lock:
+        return len(_observations[name]) if name in _observations else 0
+
+
+def percentile(name, q):
+    with _lock:
+        values = sorted(_observations[name]) if name in _observations else []
+    if not values:
+        return None
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def register(name, source):
+    # source - функция без аргументов, возвращающая dict со статистикой компонента
+    _sources[name] = source
+
+
+def snapshot():
+    with _lock:
+        result = {"counters": dict(_counters)}
+        observations = {name: sorted(values) for name, values in _observations.items() if values}
+    result["observations"] = {
+        name: {
+            "count": len(values),
+            "avg": round(sum(values) / len(values), 3),
+            "p50": values[len(values) // 2],
+            "p95": values[min(int(0.95 * len(values)), len(values) - 1)],
+        }
+        for name, values in observations.items()
+    }
+    for name, source in list(_sources.items()):
+        try:
+            result[name] = source()
+        except Exception as e:
+            result[name] = {"error": str(e)}
+    return result
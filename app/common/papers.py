@@ -0,0 +1,180 @@
+import re
+from dataclasses import dataclass
+from typing import Dict, Optional
+from app.common import logger
+from app.common import metrics
+from app.common.deadline import TurnCancelled
+from app.common.pdf_cache import fetch_pdf_pages
+from app.common.prefetch import CYBERLENINKA, pdf_links
+from app.common.router import URL_RE
+
+# Начало записи в ответе поиска: "1. Название", "**2.** Название", "3) Название".
+# Строка DOI ("10.1234/abcd") началом записи не считается
+ENTRY_RE = re.compile(r"^[ \t]*\**[ \t]*(\d{1,2})[.)](?![\d/])[ \t]*\**[ \t]*(.*)$", re.MULTILINE)
+LABEL_RE = re.compile(r"^(название(?: статьи)?|авторы?|год(?: публикации)?|doi(?: или ссылка)?|ссылка|url|"
+                      r"краткое описание|описание|аннотация)\s*\**\s*[:—–-]\s*", re.IGNORECASE)
+YEAR_RE = re.compile(r"\b(?:19|20)\d{2}\b")
+EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)*\.[a-zа-я]{2,}", re.IGNORECASE)
+# Адреса для переписки печатают на первых страницах статьи, реже - в конце
+CONTACT_PAGES = 2
+# Подписи полей в ответе поиска и поле записи, к которому они относятся
+LABELS = {
+    "название": "title", "название статьи": "title", "автор": "authors", "авторы": "authors",
+    "год": "year", "год публикации": "year", "doi": "url", "doi или ссылка": "url", "ссылка": "url", "url": "url",
+}
+
+
+@dataclass(frozen=True)
+class PaperRecord:
+    number: int
+    title: str
+    authors: str = ""
+    year: Optional[int] = None
+    url: Optional[str] = None
+    pdf_url: Optional[str] = None
+    description: str = ""
+
+    def metadata(self):
+        # Метаданные для генерации BibTeX без повторного разбора истории диалога
+        fields = [("Название", self.title), ("Авторы", self.authors), ("Год", self.year), ("Ссылка", self.url)]
+        return "\n".join(f"{name}: {value}" for name, value in fields if value)
+
+
+def _clean(line):
+    return line.strip().strip("*_-•").strip()
+
+
+def _url(value):
+    url_match = URL_RE.search(value)
+    if url_match:
+        return url_match.group(0).rstrip(".,;:!?")
+    if value.startswith("10."):
+        return f"https://doi.org/{value.split()[0]}"
+    if value.startswith("/article/"):
+        return CYBERLENINKA + value.split()[0]
+    return None
+
+
+def _guess_field(value, fields, description):
+    # Поля без подписи идут в порядке из search_prompt: авторы, год, ссылка, описание
+    if URL_RE.search(value) or value.startswith(("10.", "/article/")):
+        return "url"
+    if YEAR_RE.search(value) and len(value) <= 12:
+        return "year"
+    if not fields["authors"] and not description:
+        return "authors"
+    return "description"
+
+
+def _parse_entry(number, title_line, lines):
+    fields = {"title": _clean(LABEL_RE.sub("", _clean(title_line))), "authors": "", "year": None, "url": None}
+    description = []
+    for line in map(_clean, lines):
+        if not line:
+            continue
+        label = LABEL_RE.match(line)
+        value = _clean(line[label.end():]) if label else line
+        field = LABELS.get(label.group(1).lower(), "description") if label else _guess_field(value, fields, description)
+        if field == "title" and not fields["title"]:
+            fields["title"] = value
+        elif field == "authors" and not fields["authors"]:
+            fields["authors"] = value
+        elif field == "year" and fields["year"] is None and YEAR_RE.search(value):
+            fields["year"] = int(YEAR_RE.search(value).group(0))
+        elif field == "url" and fields["url"] is None:
+            fields["url"] = _url(value)
+        else:
+            description.append(value)
+    pdf = pdf_links("\n".join([title_line, *lines]), limit=1)
+    return PaperRecord(
+        number=number,
+        title=fields["title"].strip("«»\"“” "),
+        authors=fields["authors"],
+        year=fields["year"],
+        url=fields["url"] or (pdf[0] if pdf else None),
+        pdf_url=pdf[0] if pdf else None,
+        description=" ".join(description),
+    )
+
+
+def parse_search_results(text) -> Dict[int, PaperRecord]:
+    """Записи нумерованного списка статей из ответа поиска (формат задаёт search_prompt)."""
+    # Записи нумеруются подряд: строка с номером не по порядку относится к предыдущей записи
+    matches = []
+    for match in ENTRY_RE.finditer(text):
+        if not matches or int(match.group(1)) == int(matches[-1].group(1)) + 1:
+            matches.append(match)
+    records = {}
+    for index, match in enumerate(matches):
+        end = matches[index + 1].start() if index + 1 < len(matches) else len(text)
+        lines = text[match.end():end].splitlines()
+        number = int(match.group(1))
+        if number not in records:
+            records[number] = _parse_entry(number, match.group(2), lines)
+    return records
+
+
+class PaperRegistry:
+    """Пронумерованные статьи из последнего поиска в сессии: "статья №N" находится без обращения к модели."""
+
+    def __init__(self, memory):
+        # memory - dict из st.session_state, переживает перезапуски скрипта
+        self.memory = memory
+        self.memory.setdefault("papers", {})
+
+    def update(self, search_response):
+        records = parse_search_results(search_response)
+        if records:
+            # Номера в новом списке относятся к новому поиску
+            self.memory["papers"] = records
+            logger.info(f"Registered {len(records)} papers from search results")
+        return len(records)
+
+    def get(self, number) -> Optional[PaperRecord]:
+        if number is None:
+            return None
+        record = self.memory["papers"].get(number)
+        metrics.incr(f"papers.{'resolved' if record is not None else 'unresolved'}")
+        return record
+
+
+def find_emails(pages):
+    emails = []
+    for page in pages[:CONTACT_PAGES] + pages[CONTACT_PAGES:][-1:]:
+        for match in EMAIL_RE.finditer(page):
+            email = match.group(0).rstrip(".").lower()
+            if email not in emails:
+                emails.append(email)
+    return emails
+
+
+def author_contacts(record=None, pdf_url=None):
+    """Ответ на просьбу о контактах авторов: адреса из PDF статьи и её метаданные из списка поиска."""
+    pdf_url = pdf_url or (record.pdf_url if record is not None else None)
+    if record is None and pdf_url is None:
+        return "Укажите номер статьи из последнего поиска, например: «Покажи e-mail авторов статьи №2»."
+
+    emails = None
+    if pdf_url is not None:
+        try:
+            # PDF статей из поиска обычно уже в кэше после предзагрузки
+            pages, _ = fetch_pdf_pages(pdf_url)
+            emails = find_emails(pages)
+        except TurnCancelled:
+            raise
+        except Exception as e:
+            logger.warning(f"Could not read {pdf_url} for author contacts: {e}")
+    metrics.incr(f"papers.contacts_{'found' if emails else 'missing'}")
+
+    lines = []
+    if record is not None:
+        lines.append(f"**{record.title}**")
+        if record.authors:
+            lines.append(f"Авторы: {record.authors}")
+    if emails:
+        lines.append("Адреса для связи: " + ", ".join(emails))
+    else:
+        link = record.url if record is not None and record.url else pdf_url
+        reason = "В тексте статьи адреса авторов не нашлись." if emails is not None else "Текст статьи недоступен."
+        lines.append(reason + (f" Проверьте страницу статьи: {link}" if link else ""))
+    return "\n\n".join(lines)
@@ -0,0 +1,514 @@
+import contextvars
+import hashlib
+import io
+import math
+import re
+import socket
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from app.common import (
+    PDF_MAX_BYTES, PDF_OVERLAP_MIN_SIZE, PDF_PARALLEL_MIN_PAGES, PDF_SPOOL_SIZE, PDF_WORKERS, estimate_tokens, logger
+)
+from app.common import metrics
+from app.common.deadline import (
+    CANCEL_POLL_INTERVAL, DOWNLOAD, PARSE, DeadlineExceeded, TurnCancelled, check, check_cancelled, current, timeout_for
+)
+from app.common.resources import resource
+from app.common.transport import http_session
+
+CHUNK_SIZE = 64 * 1024
+# Тело ответа читаем небольшими частями, чтобы чаще проверять срок загрузки и отмену реплики
+READ_SIZE = 16 * 1024
+# Хвост файла с таблицей xref и trailer, который запрашиваем отдельно через Range
+TAIL_SIZE = 256 * 1024
+PDF_CONTENT_TYPES = ("application/pdf", "application/x-pdf", "application/octet-stream", "binary/octet-stream")
+# Колонтитулы ищем среди первых и последних строк страницы; колонтитул повторяется хотя бы на этой доле страниц
+EDGE_LINES = 3
+BOILERPLATE_SHARE = 0.5
+SOFT_HYPHEN = "\u00ad"
+# Сколько ждать после stop_at диапазоны, которые процессы пула остановили по сроку
+PARALLEL_RESULT_GRACE = 0.5
+
+_SPACES = re.compile(r"[ \t\u00a0\u2009]+")
+_DIGITS = re.compile(r"\d+")
+_PAGE_NUMBER = re.compile(r"^[-–—]?\s*(?:стр\.?|с\.|page)?\s*\d{1,4}(?:\s*(?:/|из|of)\s*\d{1,4})?\s*[-–—]?$", re.IGNORECASE)
+
+
+class PdfDownloadError(ValueError):
+    """Ошибка загрузки, текст которой можно показать пользователю."""
+
+
+def _check_headers(response):
+    content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+    if content_type and content_type not in PDF_CONTENT_TYPES:
+        raise PdfDownloadError(f"по ссылке не PDF, а {content_type}")
+    length = int(response.headers.get("Content-Length") or 0)
+    if length > PDF_MAX_BYTES:
+        raise PdfDownloadError(f"файл больше {PDF_MAX_BYTES // (1024 * 1024)} МБ")
+    return length
+
+
+def check_pdf_content(chunk):
+    # Сервер может назвать HTML-страницу с капчей application/octet-stream
+    if not chunk.lstrip()[:5] == b"%PDF-":
+        raise PdfDownloadError("по ссылке не PDF-документ")
+
+
+def _abort(response):
+    # close() не будит поток, который ждёт данных в recv, поэтому сначала останавливаем сокет
+    sock = getattr(getattr(response.raw, "_connection", None), "sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    response.close()
+
+
+class _DownloadWatchdog:
+    """Обрывает соединение по истечении срока загрузки или при отмене реплики, даже если чтение ждёт данных."""
+
+    def __init__(self, response, stop_at):
+        self.fired = False
+        self._response = response
+        self._stop_at = stop_at
+        self._finished = threading.Event()
+        # Сторож наследует контекст реплики, чтобы видеть её отмену
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(self._watch,), daemon=True).start()
+
+    def _watch(self):
+        while not self._finished.wait(min(CANCEL_POLL_INTERVAL, max(self._stop_at - time.monotonic(), 0.0))):
+            deadline = current()
+            if time.monotonic() >= self._stop_at or (deadline is not None and deadline.cancelled):
+                self.fired = True
+                _abort(self._response)
+                return
+
+    def stop(self):
+        self._finished.set()
+
+
+def _too_slow():
+    metrics.incr("pdf.download_timeouts")
+    return PdfDownloadError("сервер отдаёт файл слишком медленно")
+
+
+def _chunks(response, digest):
+    """Тело ответа по частям с проверкой сигнатуры, лимита размера, срока загрузки и отмены реплики.
+
+    Таймаут requests ограничивает только паузу между чтениями, поэтому общий срок стадии DOWNLOAD
+    отмеряем сами. Без реплики (предзагрузка) действует потолок стадии."""
+    received = 0
+    stop_at = time.monotonic() + timeout_for(DOWNLOAD)
+    watchdog = _DownloadWatchdog(response, stop_at)
+    try:
+        for chunk in response.iter_content(chunk_size=READ_SIZE):
+            check(DOWNLOAD)
+            if time.monotonic() >= stop_at:
+                raise _too_slow()
+            if not chunk:
+                continue
+            if received == 0:
+                check_pdf_content(chunk)
+            received += len(chunk)
+            if received > PDF_MAX_BYTES:
+                raise PdfDownloadError(f"файл больше {PDF_MAX_BYTES // (1024 * 1024)} МБ")
+            # Хэш содержимого считаем на лету: по нему кэш узнаёт уже разобранный файл
+            digest.update(chunk)
+            yield chunk
+    except Exception as e:
+        if not watchdog.fired or isinstance(e, (PdfDownloadError, DeadlineExceeded, TurnCancelled)):
+            raise
+        # Соединение оборвал сторож: отмена и срок реплики важнее ошибки чтения
+        check(DOWNLOAD)
+        raise _too_slow() from e
+    finally:
+        watchdog.stop()
+    metrics.observe("pdf.download_bytes", received)
+
+
+def spool_pdf(response, digest):
+    """Читает тело ответа в буфер запроса: обычные статьи остаются в памяти, крупные уходят во временный файл."""
+    pdf_file = tempfile.SpooledTemporaryFile(max_size=PDF_SPOOL_SIZE)
+    try:
+        for chunk in _chunks(response, digest):
+            pdf_file.write(chunk)
+    except BaseException:
+        pdf_file.close()
+        raise
+    finally:
+        response.close()
+    pdf_file.seek(0)
+    return pdf_file
+
+
+class OverlappedPdfBuffer(io.RawIOBase):
+    """Файл для PdfReader, который наполняется по мере загрузки.
+
+    Таблица xref лежит в конце PDF, поэтому хвост запрашивается отдельно через Range. После этого
+    PdfReader находит объекты страниц по смещениям, и страницы из начала файла разбираются,
+    пока остальная часть ещё качается. Чтение ещё не полученных байтов ждёт загрузки."""
+
+    def __init__(self, response, size, tail, tail_offset):
+        super().__init__()
+        self.size = size
+        self._tail = tail
+        self._tail_offset = tail_offset
+        self._data = bytearray()
+        self._position = 0
+        self._error = None
+        self._done = False
+        self._condition = threading.Condition()
+        self._response = response
+        self.digest = hashlib.sha256()
+        # Поток загрузки наследует контекст реплики, чтобы останавливаться при её отмене
+        context = contextvars.copy_context()
+        self._thread = threading.Thread(target=context.run, args=(self._download,), daemon=True)
+        self._thread.start()
+
+    def _download(self):
+        try:
+            for chunk in _chunks(self._response, self.digest):
+                with self._condition:
+                    self._data += chunk
+                    self._condition.notify_all()
+        except BaseException as e:
+            self._error = e
+        finally:
+            self._response.close()
+            with self._condition:
+                self._done = True
+                self._condition.notify_all()
+
+    def _wait_for(self, end):
+        with self._condition:
+            while len(self._data) < end and not self._done:
+                self._condition.wait(CANCEL_POLL_INTERVAL)
+                check_cancelled()
+            if self._error is not None:
+                raise self._error
+            if len(self._data) < end:
+                raise PdfDownloadError("файл загрузился не полностью")
+
+    def wait_complete(self):
+        self._wait_for(self.size)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self._position = min(max(offset, 0), self.size)
+        return self._position
+
+    def read(self, size=-1):
+        start = self._position
+        end = self.size if size is None or size < 0 else min(start + size, self.size)
+        if start >= end:
+            return b""
+        if start >= self._tail_offset:
+            result = self._tail[start - self._tail_offset:end - self._tail_offset]
+        else:
+            head_end = min(end, self._tail_offset)
+            self._wait_for(head_end)
+            result = bytes(self._data[start:head_end]) + self._tail[:max(end - self._tail_offset, 0)]
+        self._position = end
+        return result
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        # Незавершённую загрузку обрывает закрытие соединения
+        self._response.close()
+        super().close()
+
+
+def _fetch_tail(pdf_url, size):
+    response = http_session.get(
+        pdf_url,
+        headers={"Range": f"bytes={size - TAIL_SIZE}-{size - 1}"},
+        timeout=timeout_for(DOWNLOAD)
+    )
+    if response.status_code != 206 or len(response.content) != TAIL_SIZE:
+        return None
+    return response.content
+
+
+class PdfDownload:
+    """Открытый для разбора PDF со сведениями для кэша: валидаторы HTTP и хэш содержимого."""
+
+    def __init__(self, file, headers, digest, overlapped=None):
+        self.file = file
+        self.etag = headers.get("ETag")
+        self.last_modified = headers.get("Last-Modified")
+        self._digest = digest
+        self._overlapped = overlapped
+
+    @property
+    def overlapped(self):
+        return self._overlapped is not None
+
+    def content_hash(self):
+        # Файл, который разбирается по ходу загрузки, приходится дождаться целиком
+        if self._overlapped is not None:
+            self._overlapped.wait_complete()
+        return self._digest.hexdigest()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def download_pdf(pdf_url, etag=None, last_modified=None):
+    """Открывает PDF для разбора: проверяет тип и размер по заголовкам до загрузки тела.
+
+    С etag/last_modified запрос условный: если файл не менялся, возвращает None.
+    Для крупных файлов с поддержкой Range разбор начинается до окончания загрузки."""
+    started = time.perf_counter()
+    conditional_headers = {}
+    if etag:
+        conditional_headers["If-None-Match"] = etag
+    if last_modified:
+        conditional_headers["If-Modified-Since"] = last_modified
+    response = http_session.get(pdf_url, headers=conditional_headers, timeout=timeout_for(DOWNLOAD), stream=True)
+    try:
+        if response.status_code == 304:
+            response.close()
+            return None
+        response.raise_for_status()
+        size = _check_headers(response)
+    except BaseException:
+        response.close()
+        raise
+
+    overlap = (
+        PDF_OVERLAP_MIN_SIZE <= size <= PDF_SPOOL_SIZE
+        and size > TAIL_SIZE
+        and response.headers.get("Accept-Ranges", "").lower() == "bytes"
+        and not response.headers.get("Content-Encoding")
+    )
+    tail = None
+    if overlap:
+        try:
+            tail = _fetch_tail(pdf_url, size)
+        except Exception as e:
+            logger.warning(f"Could not fetch PDF tail, parsing after full download: {e}")
+
+    if tail is None:
+        digest = hashlib.sha256()
+        pdf_file = spool_pdf(response, digest)
+        metrics.observe("pdf.download_s", time.perf_counter() - started)
+        return PdfDownload(pdf_file, response.headers, digest)
+
+    metrics.incr("pdf.overlapped_downloads")
+    logger.info(f"Parsing {size} byte PDF while it downloads")
+    buffer = OverlappedPdfBuffer(response, size, tail, size - TAIL_SIZE)
+    # PdfReader читает по нескольку байт, буферизация снимает накладные расходы на каждое чтение
+    pdf_file = io.BufferedReader(buffer, buffer_size=CHUNK_SIZE)
+    return PdfDownload(pdf_file, response.headers, buffer.digest, overlapped=buffer)
+
+
+@resource
+def pdf_pool():
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    # Процесс Streamlit многопоточный, и fork может унаследовать чужие захваченные блокировки
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("forkserver" if "forkserver" in methods else None)
+    pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=context, initializer=_warm_up_worker)
+    # Поднимаем процессы заранее, чтобы первая большая статья не платила за их старт
+    for _ in range(PDF_WORKERS):
+        pool.submit(time.sleep, 0)
+    return pool
+
+
+def _warm_up_worker():
+    import PyPDF2  # noqa: F401
+
+
+def _extract_range(content, start, stop, stop_at):
+    """Выполняется в процессе пула: текст и время разбора страниц [start, stop) до момента stop_at."""
+    import PyPDF2
+
+    read_pdf = PyPDF2.PdfReader(io.BytesIO(content))
+    pages = []
+    for page_number in range(start, stop):
+        if time.time() > stop_at:
+            break
+        started = time.perf_counter()
+        page_text = read_pdf.pages[page_number].extract_text()
+        pages.append((page_text, time.perf_counter() - started))
+    return pages
+
+
+def _extract_serial(read_pdf, number_of_pages, stop_at):
+    pages = []
+    for page_number in range(number_of_pages):
+        # Реплику сменила новая - оставшиеся страницы никому не нужны
+        check_cancelled()
+        if time.time() > stop_at:
+            break
+        started = time.perf_counter()
+        page_text = read_pdf.pages[page_number].extract_text()
+        pages.append((page_text, time.perf_counter() - started))
+    return pages
+
+
+def _range_result(future, stop_at):
+    # Процессы сами останавливаются в stop_at, но уже начатая тяжёлая страница может задержать ответ
+    while True:
+        remaining = stop_at + PARALLEL_RESULT_GRACE - time.time()
+        if remaining <= 0:
+            return None
+        try:
+            return future.result(timeout=min(CANCEL_POLL_INTERVAL, remaining))
+        except FutureTimeoutError:
+            check_cancelled()
+
+
+def _extract_parallel(content, number_of_pages, stop_at):
+    # По одному непрерывному диапазону на процесс: каждая задача получает копию PDF
+    step = -(-number_of_pages // PDF_WORKERS)
+    ranges = [(start, min(start + step, number_of_pages)) for start in range(0, number_of_pages, step)]
+    pool = pdf_pool()
+    futures = []
+    pages = []
+    try:
+        futures = [pool.submit(_extract_range, content, start, stop, stop_at) for start, stop in ranges]
+        for (start, stop), future in zip(ranges, futures):
+            range_pages = _range_result(future, stop_at)
+            # Срок разбора вышел - отдаём то, что успели
+            if range_pages is None:
+                break
+            pages.extend(range_pages)
+            # Текст собираем без пропусков: после недочитанного диапазона страницы не берём
+            if len(range_pages) < stop - start:
+                break
+    except BrokenProcessPool:
+        # Упавший процесс ломает весь пул, поэтому следующий разбор получит новый
+        if pdf_pool.reset(pool):
+            pool.shutdown(wait=False, cancel_futures=True)
+            metrics.incr("pdf.pool_rebuilt")
+        raise
+    finally:
+        for future in futures:
+            future.cancel()
+    return pages
+
+
+def extract_pdf_pages(source):
+    """Возвращает (тексты страниц, прочитаны ли все страницы): разбор останавливается по таймауту стадии PARSE.
+
+    source - байты PDF или открытый бинарный файл. Большие документы разбираются пулом процессов."""
+    import PyPDF2
+
+    started = time.perf_counter()
+    stop_at = time.time() + timeout_for(PARSE)
+    # PdfReader читает объекты по мере обращения, поэтому буфер живёт до конца разбора
+    pdf_file = io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+    read_pdf = PyPDF2.PdfReader(pdf_file)
+    number_of_pages = len(read_pdf.pages)
+
+    # Файл, который ещё качается, читаем последовательно: так разбор идёт вместе с загрузкой
+    overlapped = isinstance(getattr(pdf_file, "raw", None), OverlappedPdfBuffer)
+    pages = None
+    if PDF_WORKERS > 1 and number_of_pages >= PDF_PARALLEL_MIN_PAGES and not overlapped:
+        pdf_file.seek(0)
+        try:
+            pages = _extract_parallel(pdf_file.read(), number_of_pages, stop_at)
+            mode = "parallel"
+        except (BrokenProcessPool, OSError) as e:
+            logger.error(f"PDF worker pool failed, extracting serially: {e}")
+    if pages is None:
+        pages = _extract_serial(read_pdf, number_of_pages, stop_at)
+        mode = "serial"
+
+    for _, seconds in pages:
+        metrics.observe("pdf.page_s", seconds)
+    elapsed = time.perf_counter() - started
+    metrics.observe(f"pdf.parse_s.{mode}", elapsed)
+    if pages:
+        slowest = max(range(len(pages)), key=lambda index: pages[index][1])
+        logger.info(
+            f"Extracted {len(pages)}/{number_of_pages} pages in {elapsed:.2f}s ({mode}), "
+            f"slowest page {slowest + 1}: {pages[slowest][1]:.3f}s"
+        )
+    complete = len(pages) == number_of_pages
+    if not complete:
+        logger.warning(f"PDF parse budget exhausted after {len(pages)} of {number_of_pages} pages")
+    return [page_text for page_text, _ in pages], complete
+
+
+def _line_key(line):
+    # Номер страницы внутри колонтитула меняется, поэтому цифры не различаем
+    return _DIGITS.sub("#", line.lower())
+
+
+def clean_pdf_pages(pages):
+    """Склеивает страницы в текст без колонтитулов, номеров страниц, переносов слов и лишних пробелов."""
+    page_lines = [[_SPACES.sub(" ", line).strip() for line in page.splitlines()] for page in pages]
+    edges = []
+    counts = Counter()
+    for lines in page_lines:
+        filled = [index for index, line in enumerate(lines) if line]
+        page_edges = set(filled[:EDGE_LINES] + filled[-EDGE_LINES:])
+        edges.append(page_edges)
+        counts.update({_line_key(lines[index]) for index in page_edges})
+    threshold = max(2, math.ceil(len(pages) * BOILERPLATE_SHARE))
+    boilerplate = {key for key, count in counts.items() if count >= threshold}
+
+    # Один проход по строкам: выбрасываем колонтитулы, склеиваем перенесённые слова, схлопываем пустые строки
+    output = []
+    for lines, page_edges in zip(page_lines, edges):
+        for index, line in enumerate(lines):
+            if not line:
+                if output and output[-1]:
+                    output.append("")
+                continue
+            if index in page_edges and (_line_key(line) in boilerplate or _PAGE_NUMBER.match(line)):
+                continue
+            previous = output[-1] if output else ""
+            if previous[-1:] in ("-", SOFT_HYPHEN) and previous[-2:-1].isalpha() and line[0].islower():
+                output[-1] = previous[:-1] + line.replace(SOFT_HYPHEN, "")
+            else:
+                output.append(line.replace(SOFT_HYPHEN, ""))
+    text = "\n".join(output).strip()
+
+    raw_chars = sum(len(page) for page in pages)
+    saved_chars = raw_chars - len(text)
+    saved_tokens = estimate_tokens("".join(pages)) - estimate_tokens(text)
+    metrics.incr("pdf.cleanup_saved_chars", saved_chars)
+    metrics.incr("pdf.cleanup_saved_tokens", saved_tokens)
+    logger.info(
+        f"Cleaned PDF text: {raw_chars} -> {len(text)} chars, ~{saved_tokens} tokens saved, "
+        f"{len(boilerplate)} repeated header/footer lines"
+    )
+    return text
+
+
+def extract_pdf_text(source):
+    pages, complete = extract_pdf_pages(source)
+    return clean_pdf_pages(pages), complete
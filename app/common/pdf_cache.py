@@ -0,0 +1,217 @@
+import json
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from app.common import DATA_PATH, PDF_CACHE, PDF_CACHE_FRESH, PDF_CACHE_MAX_BYTES, logger
+from app.common import metrics
+from app.common.deadline import CANCEL_POLL_INTERVAL, DOWNLOAD, check
+from app.common.pdf import download_pdf, extract_pdf_pages
+from app.common.singleflight import LeaderAbandoned, SingleFlight
+
+
+class PdfTextCache:
+    """Кэш текста PDF на диске: страницы сжаты zlib, файл с одинаковым содержимым хранится один раз."""
+
+    def __init__(self, path, max_bytes=PDF_CACHE_MAX_BYTES, fresh_for=PDF_CACHE_FRESH):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.fresh_for = fresh_for
+        self._index_file = os.path.join(path, "index.json")
+        # url -> {"hash", "etag", "last_modified", "validated_at"}
+        self._urls = {}
+        # хэш содержимого -> размер сжатой записи, от давно не использованных к свежим
+        self._blobs = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.revalidated = 0
+        self.shared = 0
+        self.misses = 0
+        self._load()
+
+    def _blob_file(self, content_hash):
+        return os.path.join(self.path, content_hash[:2], f"{content_hash}.zlib")
+
+    def _load(self):
+        try:
+            with open(self._index_file, "r") as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.error(f"PDF cache index is unreadable, starting empty: {e}")
+            return
+        self._blobs = OrderedDict((content_hash, size) for content_hash, size in index.get("blobs", []))
+        self._urls = {url: entry for url, entry in index.get("urls", {}).items() if entry["hash"] in self._blobs}
+
+    def _save(self):
+        # Вызывается под self._lock
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            tmp_path = f"{self._index_file}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"urls": self._urls, "blobs": list(self._blobs.items())}, f, ensure_ascii=False)
+            os.replace(tmp_path, self._index_file)
+        except OSError as e:
+            logger.error(f"Failed to write PDF cache index: {e}")
+
+    def _forget(self, content_hash):
+        self._blobs.pop(content_hash, None)
+        for url in [url for url, entry in self._urls.items() if entry["hash"] == content_hash]:
+            del self._urls[url]
+        try:
+            os.remove(self._blob_file(content_hash))
+        except OSError:
+            pass
+
+    def lookup(self, url):
+        with self._lock:
+            entry = self._urls.get(url)
+            return dict(entry) if entry is not None else None
+
+    def is_fresh(self, entry):
+        return time.time() - entry["validated_at"] < self.fresh_for
+
+    def pages(self, content_hash):
+        with self._lock:
+            if content_hash not in self._blobs:
+                return None
+            self._blobs.move_to_end(content_hash)
+        try:
+            with open(self._blob_file(content_hash), "rb") as f:
+                return json.loads(zlib.decompress(f.read()).decode("utf-8"))
+        except (OSError, ValueError, zlib.error) as e:
+            logger.error(f"Dropping broken PDF cache entry {content_hash}: {e}")
+            with self._lock:
+                self._forget(content_hash)
+                self._save()
+            return None
+
+    def put(self, url, content_hash, pages, etag=None, last_modified=None):
+        with self._lock:
+            if content_hash not in self._blobs:
+                blob = zlib.compress(json.dumps(pages, ensure_ascii=False).encode("utf-8"))
+                path = self._blob_file(content_hash)
+                try:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                    with open(tmp_path, "wb") as f:
+                        f.write(blob)
+                    os.replace(tmp_path, path)
+                except OSError as e:
+                    logger.error(f"Failed to write PDF cache entry: {e}")
+                    return
+                self._blobs[content_hash] = len(blob)
+            self._blobs.move_to_end(content_hash)
+            self._urls[url] = {
+                "hash": content_hash,
+                "etag": etag,
+                "last_modified": last_modified,
+                "validated_at": time.time(),
+            }
+            self._evict(keep=content_hash)
+            self._save()
+
+    def mark_validated(self, url):
+        with self._lock:
+            if url in self._urls:
+                self._urls[url]["validated_at"] = time.time()
+                self._save()
+
+    def _evict(self, keep):
+        total = sum(self._blobs.values())
+        while total > self.max_bytes and len(self._blobs) > 1:
+            content_hash = next(iter(self._blobs))
+            if content_hash == keep:
+                break
+            total -= self._blobs[content_hash]
+            self._forget(content_hash)
+            metrics.incr("pdf_cache.evictions")
+
+    def record(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+        metrics.incr(f"pdf_cache.{counter}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "documents": len(self._blobs),
+                "urls": len(self._urls),
+                "bytes": sum(self._blobs.values()),
+                "hits": self.hits,
+                "revalidated": self.revalidated,
+                "shared": self.shared,
+                "misses": self.misses,
+            }
+
+
+pdf_text_cache = PdfTextCache(os.path.join(DATA_PATH, "pdf_cache"))
+# Чтение статьи, которую в этот момент скачивает предзагрузка, дожидается её, а не качает второй раз
+pdf_flight = SingleFlight("pdf")
+metrics.register("pdf_cache", lambda: {**pdf_text_cache.stats(), "singleflight": pdf_flight.stats()})
+
+
+def fetch_pdf_pages(pdf_url):
+    """Тексты страниц PDF: из кэша без запросов, после условного GET или после загрузки и разбора.
+
+    Возвращает (страницы, прочитаны ли все страницы)."""
+    if not PDF_CACHE:
+        with download_pdf(pdf_url) as download:
+            return extract_pdf_pages(download.file)
+
+    entry = pdf_text_cache.lookup(pdf_url)
+    if entry is not None and pdf_text_cache.is_fresh(entry):
+        pages = pdf_text_cache.pages(entry["hash"])
+        if pages is not None:
+            pdf_text_cache.record("hits")
+            return pages, True
+
+    while True:
+        call, leader = pdf_flight.begin(pdf_url)
+        if leader:
+            break
+        while not call.ready(CANCEL_POLL_INTERVAL):
+            check(DOWNLOAD)
+        try:
+            return call.wait()
+        except LeaderAbandoned:
+            # Загрузку бросили из-за отмены или срока чужой реплики - качаем сами
+            continue
+    try:
+        result = _fetch_pdf_pages(pdf_url, entry)
+    except BaseException as e:
+        pdf_flight.finish(pdf_url, call, error=e)
+        raise
+    pdf_flight.finish(pdf_url, call, result=result)
+    return result
+
+
+def _fetch_pdf_pages(pdf_url, entry):
+    download = None
+    if entry is not None:
+        download = download_pdf(pdf_url, etag=entry["etag"], last_modified=entry["last_modified"])
+        if download is None:
+            # 304 Not Modified: файл тот же, текст берём из кэша
+            pages = pdf_text_cache.pages(entry["hash"])
+            if pages is not None:
+                pdf_text_cache.mark_validated(pdf_url)
+                pdf_text_cache.record("revalidated")
+                return pages, True
+    if download is None:
+        download = download_pdf(pdf_url)
+
+    with download:
+        # Тот же файл мог уже разбираться под другой ссылкой или с новым ETag
+        pages = pdf_text_cache.pages(download.content_hash()) if not download.overlapped else None
+        if pages is not None:
+            pdf_text_cache.record("shared")
+            complete = True
+        else:
+            pdf_text_cache.record("misses")
+            pages, complete = extract_pdf_pages(download.file)
+        # Неполный текст (кончилось время на разбор) не кэшируем
+        if complete:
+            pdf_text_cache.put(pdf_url, download.content_hash(), pages, download.etag, download.last_modified)
+    return pages, complete
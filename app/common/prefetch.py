@@ -0,0 +1,133 @@
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from app.common import (
+    PDF_CACHE, PDF_PREFETCH, PDF_PREFETCH_PENDING, PDF_PREFETCH_SESSION, TOP_K_PAPERS, logger
+)
+from app.common import metrics
+from app.common.pdf_cache import fetch_pdf_pages, pdf_text_cache
+from app.common.router import URL_RE
+
+CYBERLENINKA = "https://cyberleninka.ru"
+# Относительные ссылки на статьи, как их возвращает поиск: "/article/n/nazvaniye-dokumenta"
+ARTICLE_PATH_RE = re.compile(r"(?<![\w/.])/article/n/[\w\-]+")
+# Насколько понижать приоритет потока предзагрузки в ОС (nice), чтобы он уступал ответам пользователям
+PREFETCH_NICENESS = 10
+
+
+def pdf_links(text, limit=TOP_K_PAPERS):
+    """Первые limit ссылок на PDF в ответе поиска. Страницы статей cyberleninka превращаются в ссылки на их PDF."""
+    # Ссылки берём в порядке их появления в ответе, то есть в порядке статей в списке
+    candidates = [(match.start(), match.group(0).rstrip(".,;:!?")) for match in URL_RE.finditer(text)]
+    candidates += [(match.start(), CYBERLENINKA + match.group(0)) for match in ARTICLE_PATH_RE.finditer(text)]
+    links = []
+    for _, url in sorted(candidates):
+        if "cyberleninka.ru/article/" in url and not url.endswith("/pdf"):
+            url = url.rstrip("/") + "/pdf"
+        elif not url.lower().endswith((".pdf", "/pdf")):
+            # DOI и страницы журналов ведут на HTML, качать их впустую не стоит
+            continue
+        if url not in links:
+            links.append(url)
+        if len(links) >= limit:
+            break
+    return links
+
+
+def _lower_priority():
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), PREFETCH_NICENESS)
+    except (AttributeError, OSError) as e:
+        logger.info(f"Prefetch thread keeps normal priority: {e}")
+
+
+class PdfPrefetcher:
+    """Скачивает и разбирает PDF из результатов поиска в кэш текста, пока пользователь читает список."""
+
+    def __init__(self, session_budget=PDF_PREFETCH_SESSION, max_pending=PDF_PREFETCH_PENDING):
+        self.session_budget = session_budget
+        self.max_pending = max_pending
+        # Один фоновый поток: предзагрузка не должна отнимать пропускную способность у ответов
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="prefetch", initializer=_lower_priority
+        )
+        self._pending = set()
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.skipped = 0
+        self.completed = 0
+        self.failed = 0
+
+    def submit(self, urls, memory=None):
+        # memory - dict из st.session_state, в нём хранится потраченный бюджет сессии
+        if memory is not None:
+            memory.setdefault("prefetched", 0)
+        for url in urls:
+            entry = pdf_text_cache.lookup(url)
+            if entry is not None and pdf_text_cache.is_fresh(entry):
+                continue
+            if memory is not None and memory["prefetched"] >= self.session_budget:
+                self._skip(url, "session budget exhausted")
+                continue
+            with self._lock:
+                if url in self._pending:
+                    continue
+                queue_full = len(self._pending) >= self.max_pending
+                if not queue_full:
+                    self._pending.add(url)
+                    self.submitted += 1
+            if queue_full:
+                self._skip(url, "global queue is full")
+                continue
+            if memory is not None:
+                memory["prefetched"] += 1
+            metrics.incr("prefetch.submitted")
+            # Поток пула не наследует контекст реплики, поэтому её дедлайн и отмена на предзагрузку не действуют
+            self._executor.submit(self._prefetch, url)
+
+    def _skip(self, url, reason):
+        with self._lock:
+            self.skipped += 1
+        metrics.incr("prefetch.skipped")
+        logger.info(f"Not prefetching {url}: {reason}")
+
+    def _prefetch(self, url):
+        try:
+            _, complete = fetch_pdf_pages(url)
+            with self._lock:
+                self.completed += 1
+            metrics.incr("prefetch.completed")
+            logger.info(f"Prefetched {url}{'' if complete else ' (partially, not cached)'}")
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            metrics.incr("prefetch.failed")
+            logger.info(f"Prefetch of {url} failed: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(url)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "submitted": self.submitted,
+                "skipped": self.skipped,
+                "completed": self.completed,
+                "failed": self.failed,
+            }
+
+
+pdf_prefetcher = PdfPrefetcher()
+metrics.register("pdf_prefetch", pdf_prefetcher.stats)
+
+
+def prefetch_search_results(search_response, memory=None):
+    """Ставит в фоновую загрузку PDF первых TOP_K_PAPERS статей из ответа поиска."""
+    if not (PDF_PREFETCH and PDF_CACHE):
+        return
+    try:
+        pdf_prefetcher.submit(pdf_links(search_response), memory)
+    except Exception as e:
+        logger.error(f"Failed to schedule PDF prefetch: {e}")
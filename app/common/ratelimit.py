@@ -0,0 +1,277 @@
+import asyncio
+import random
+import sys
+import threading
+import time
+import requests
+from app.common import RATE_LIMIT_RETRIES, RATE_LIMIT_RPS, RATE_LIMIT_TPM, logger
+from app.common import metrics
+from app.common.deadline import (
+    LLM, DeadlineExceeded, check as check_deadline, current as current_deadline, is_turn_scoped, sleep as deadline_sleep
+)
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+# Доля бюджета, которую фоновые задачи не трогают: она остаётся для интерактивного чата
+BATCH_RESERVE = 0.3
+# Нижняя граница, до которой AIMD может снизить скорость запросов
+MIN_RATE_FRACTION = 0.1
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 20.0
+
+
+class UpstreamError(ValueError):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class RateLimitError(UpstreamError):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message, status_code=429)
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value):
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def check_response(response, error_prefix):
+    """Превращает неуспешный ответ GigaChat в исключение, по которому limiter решает, повторять ли запрос."""
+    if response.status_code == 200:
+        return response
+
+    error_msg = f"{error_prefix}. Status code: {response.status_code}"
+    if response.text:
+        try:
+            error_data = response.json()
+            error_msg += f", Error: {error_data.get('error', {}).get('message', response.text) if isinstance(error_data.get('error'), dict) else error_data.get('message', response.text)}"
+        except Exception:
+            error_msg += f", Response: {response.text}"
+    if response.status_code == 429:
+        raise RateLimitError(error_msg, retry_after=parse_retry_after(response.headers.get("Retry-After")))
+    raise UpstreamError(error_msg, status_code=response.status_code)
+
+
+def _sdk_status(error):
+    """(код ответа, заголовки) для ошибки ответа gigachat или (None, None) для прочих ошибок."""
+    # gigachat импортируется лениво ради холодного старта: пока его нет в sys.modules, его ошибок быть не может
+    exceptions = sys.modules.get("gigachat.exceptions")
+    if exceptions is None or not isinstance(error, exceptions.ResponseError):
+        return None, None
+    status_code = getattr(error, "status_code", None)
+    headers = getattr(error, "headers", None)
+    # gigachat<0.2 хранил ResponseError(url, status_code, content, headers) только в args
+    args = error.args
+    if status_code is None and len(args) >= 2 and isinstance(args[1], int):
+        status_code = args[1]
+        headers = args[3] if len(args) >= 4 else None
+    return status_code, headers or {}
+
+
+def _classify(error):
+    """Возвращает (можно ли повторить, сколько ждать по Retry-After)."""
+    if isinstance(error, RateLimitError):
+        return True, error.retry_after
+    if isinstance(error, UpstreamError):
+        return error.status_code is not None and error.status_code >= 500, None
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True, None
+
+    status_code, headers = _sdk_status(error)
+    if status_code is None:
+        return False, None
+    if status_code == 429:
+        return True, parse_retry_after(headers.get("retry-after") or headers.get("Retry-After"))
+    return status_code >= 500, None
+
+
+def is_upstream_failure(error):
+    # Сбой на стороне GigaChat или сети, а не ошибка в самом запросе. Срок и отмена реплики сбоем не считаются
+    if is_turn_scoped(error):
+        return False
+    return _classify(error)[0] or isinstance(error, TimeoutError)
+
+
+def _is_throttle(error):
+    if isinstance(error, RateLimitError):
+        return True
+    return _sdk_status(error)[0] == 429
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, reserve=0.0):
+        need = amount + reserve * self.capacity - self.level
+        return max(need / self.rate, 0.0) if self.rate > 0 else float("inf")
+
+
+class RateLimiter:
+    """Общий лимит запросов/сек и токенов/мин с AIMD-подстройкой под ответы 429 и приоритетами."""
+
+    def __init__(self, rps=RATE_LIMIT_RPS, tokens_per_minute=RATE_LIMIT_TPM, retries=RATE_LIMIT_RETRIES):
+        self.max_rps = rps
+        self.requests = TokenBucket(rps, max(rps, 1.0))
+        self.tokens = TokenBucket(tokens_per_minute / 60.0, tokens_per_minute)
+        self.retries = retries
+        self.blocked_until = 0.0
+        self.interactive_waiting = 0
+        self._lock = threading.Lock()
+        self.throttled = 0
+        self.retried = 0
+
+    def _try_acquire(self, tokens, priority):
+        """Возвращает 0, если бюджет выдан, иначе сколько секунд подождать."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            # Токенов запрошено больше, чем влезает в ведро - пропускаем, когда оно полное
+            tokens = min(tokens, self.tokens.capacity)
+
+            reserve = 0.0
+            if priority == BATCH:
+                if self.interactive_waiting:
+                    return 0.05
+                reserve = BATCH_RESERVE
+
+            wait = max(self.requests.wait_time(1, reserve), self.tokens.wait_time(tokens, reserve))
+            if wait > 0:
+                return wait
+            self.requests.level -= 1
+            self.tokens.level -= tokens
+            return 0.0
+
+    def acquire(self, tokens=1, priority=INTERACTIVE):
+        started = time.monotonic()
+        if priority == INTERACTIVE:
+            with self._lock:
+                self.interactive_waiting += 1
+        try:
+            while True:
+                check_deadline(LLM)
+                wait = self._try_acquire(tokens, priority)
+                if wait <= 0:
+                    break
+                time.sleep(min(wait, 1.0))
+        finally:
+            if priority == INTERACTIVE:
+                with self._lock:
+                    self.interactive_waiting -= 1
+        metrics.observe(f"ratelimit.wait_s.{priority}", time.monotonic() - started)
+
+    async def aacquire(self, tokens=1, priority=INTERACTIVE):
+        started = time.monotonic()
+        if priority == INTERACTIVE:
+            with self._lock:
+                self.interactive_waiting += 1
+        try:
+            while True:
+                check_deadline(LLM)
+                wait = self._try_acquire(tokens, priority)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(min(wait, 1.0))
+        finally:
+            if priority == INTERACTIVE:
+                with self._lock:
+                    self.interactive_waiting -= 1
+        metrics.observe(f"ratelimit.wait_s.{priority}", time.monotonic() - started)
+
+    def on_success(self):
+        # Additive increase: после каждого успешного ответа понемногу возвращаем скорость
+        with self._lock:
+            self.requests.rate = min(self.max_rps, self.requests.rate + self.max_rps * 0.05)
+
+    def on_throttle(self, retry_after=None):
+        # Multiplicative decrease и пауза для всех по Retry-After
+        with self._lock:
+            self.throttled += 1
+            self.requests.rate = max(self.max_rps * MIN_RATE_FRACTION, self.requests.rate / 2)
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+        metrics.incr("ratelimit.throttled")
+        logger.warning(f"GigaChat throttled the client, request rate lowered to {self.requests.rate:.2f}/s")
+
+    def _backoff(self, attempt, retry_after):
+        delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+        return max(delay, retry_after or 0.0)
+
+    def _fits_deadline(self, delay):
+        # Повтор, который не успеет до дедлайна реплики, бессмысленен
+        deadline = current_deadline()
+        return deadline is None or delay < deadline.remaining()
+
+    def call(self, fn, tokens=1, priority=INTERACTIVE):
+        for attempt in range(self.retries + 1):
+            self.acquire(tokens, priority)
+            try:
+                result = fn()
+            except Exception as e:
+                retryable, retry_after = _classify(e)
+                if _is_throttle(e):
+                    self.on_throttle(retry_after)
+                if not retryable or attempt == self.retries:
+                    raise
+                delay = self._backoff(attempt, retry_after)
+                if not self._fits_deadline(delay):
+                    raise DeadlineExceeded(LLM) from e
+                self.retried += 1
+                metrics.incr("ratelimit.retries")
+                logger.warning(f"Retrying GigaChat call in {delay:.1f}s after error: {e}")
+                deadline_sleep(delay)
+                continue
+            self.on_success()
+            return result
+
+    async def acall(self, coro_fn, tokens=1, priority=INTERACTIVE):
+        for attempt in range(self.retries + 1):
+            await self.aacquire(tokens, priority)
+            try:
+                result = await coro_fn()
+            except Exception as e:
+                retryable, retry_after = _classify(e)
+                if _is_throttle(e):
+                    self.on_throttle(retry_after)
+                if not retryable or attempt == self.retries:
+                    raise
+                delay = self._backoff(attempt, retry_after)
+                if not self._fits_deadline(delay):
+                    raise DeadlineExceeded(LLM) from e
+                self.retried += 1
+                metrics.incr("ratelimit.retries")
+                logger.warning(f"Retrying GigaChat call in {delay:.1f}s after error: {e}")
+                await asyncio.sleep(delay)
+                continue
+            self.on_success()
+            return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "rps": round(self.requests.rate, 2),
+                "max_rps": self.max_rps,
+                "tokens_available": int(self.tokens.level),
+                "blocked_for_s": round(max(self.blocked_until - time.monotonic(), 0), 1),
+                "throttled": self.throttled,
+                "retried": self.retried,
+            }
+
+
+rate_limiter = RateLimiter()
+metrics.register("rate_limiter", rate_limiter.stats)
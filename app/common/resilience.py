@@ -0,0 +1,184 @@
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
+from app.common import (
+    BREAKER_COOLDOWN, BREAKER_ERROR_RATE, BREAKER_WINDOW, HEDGE_MIN_SAMPLES, HEDGING, HTTP_POOL_SIZE, logger
+)
+from app.common import metrics
+from app.common.deadline import CANCEL_POLL_INTERVAL, check_cancelled, is_turn_scoped
+from app.common.ratelimit import is_upstream_failure
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_executor = ThreadPoolExecutor(max_workers=HTTP_POOL_SIZE, thread_name_prefix="hedge")
+
+
+class CircuitOpenError(RuntimeError):
+    def __init__(self, name, retry_in):
+        super().__init__(f"Circuit {name} is open, retry in {retry_in:.0f}s")
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Размыкается при всплеске ошибок upstream и отвечает отказом сразу, пока сервис не восстановится."""
+
+    def __init__(self, name, window=BREAKER_WINDOW, error_rate=BREAKER_ERROR_RATE, cooldown=BREAKER_COOLDOWN):
+        self.name = name
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+        # Не размыкаемся по паре ошибок на холодном старте
+        self.min_calls = max(window // 2, 1)
+        self._outcomes = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+            self._state = HALF_OPEN
+            self._probe_in_flight = False
+        return self._state
+
+    def before_call(self):
+        with self._lock:
+            state = self._current_state()
+            # В полуоткрытом состоянии пропускаем один пробный вызов
+            if state == CLOSED or (state == HALF_OPEN and not self._probe_in_flight):
+                self._probe_in_flight = state == HALF_OPEN
+                return
+            self.rejected += 1
+            retry_in = max(self.cooldown - (time.monotonic() - self._opened_at), 0.0)
+        metrics.incr(f"breaker.{self.name}.rejected")
+        raise CircuitOpenError(self.name, retry_in)
+
+    def record(self, error=None):
+        failed = error is not None and is_upstream_failure(error)
+        with self._lock:
+            if error is not None and is_turn_scoped(error):
+                # Отмена или срок реплики ничего не говорят о здоровье upstream: освобождаем пробу, не меняя состояние
+                if self._state == HALF_OPEN:
+                    self._probe_in_flight = False
+                return
+            if self._state == HALF_OPEN:
+                self._probe_in_flight = False
+                if failed:
+                    self._open()
+                else:
+                    self._state = CLOSED
+                    self._outcomes.clear()
+                    logger.info(f"Circuit {self.name} closed")
+                return
+
+            self._outcomes.append(failed)
+            if self._state == CLOSED and len(self._outcomes) >= self.min_calls:
+                if sum(self._outcomes) / len(self._outcomes) >= self.error_rate:
+                    self._open()
+
+    def _open(self):
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self.opened += 1
+        metrics.incr(f"breaker.{self.name}.opened")
+        logger.warning(f"Circuit {self.name} opened for {self.cooldown:.0f}s")
+
+    def call(self, fn):
+        self.before_call()
+        try:
+            result = fn()
+        except BaseException as e:
+            self.record(e)
+            raise
+        self.record()
+        return result
+
+    async def acall(self, coro_fn):
+        self.before_call()
+        try:
+            result = await coro_fn()
+        except BaseException as e:
+            self.record(e)
+            raise
+        self.record()
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self._current_state(),
+                "error_rate": round(sum(self._outcomes) / len(self._outcomes), 3) if self._outcomes else None,
+                "calls_in_window": len(self._outcomes),
+                "opened": self.opened,
+                "rejected": self.rejected,
+            }
+
+
+def hedge_delay(latency_metric):
+    """p95 наблюдаемой задержки или None, если замеров пока мало."""
+    if metrics.count(latency_metric) < HEDGE_MIN_SAMPLES:
+        return None
+    return metrics.percentile(latency_metric, 0.95)
+
+
+def _discard_result(future, discard):
+    if discard is not None and not future.cancelled() and future.exception() is None:
+        try:
+            discard(future.result())
+        except Exception as e:
+            logger.error(f"Failed to release hedged response: {e}")
+
+
+def hedged(fn, latency_metric, discard=None, enabled=True):
+    """Если fn не ответил за p95 latency_metric, запускает дубль и возвращает первый успешный ответ.
+
+    discard освобождает ответ проигравшего вызова (например, закрывает поток)."""
+    delay = hedge_delay(latency_metric) if HEDGING and enabled else None
+    if delay is None:
+        return fn()
+
+    # Каждому потоку своя копия контекста, чтобы дедлайн реплики действовал и в дубле
+    primary = _executor.submit(contextvars.copy_context().run, fn)
+    try:
+        return primary.result(timeout=delay)
+    except FutureTimeoutError:
+        pass
+
+    metrics.incr("hedge.fired")
+    logger.info(f"No response after {delay:.2f}s (p95 of {latency_metric}), sending a hedged request")
+    backup = _executor.submit(contextvars.copy_context().run, fn)
+    pending = {primary, backup}
+    error = None
+    while pending:
+        done, pending = wait(pending, timeout=CANCEL_POLL_INTERVAL, return_when=FIRST_COMPLETED)
+        if not done:
+            try:
+                check_cancelled()
+            except Exception:
+                for future in pending:
+                    future.add_done_callback(lambda loser: _discard_result(loser, discard))
+                raise
+            continue
+        for future in done:
+            if future.exception() is None:
+                if future is backup:
+                    metrics.incr("hedge.won")
+                for other in pending:
+                    other.add_done_callback(lambda loser: _discard_result(loser, discard))
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+gigachat_breaker = CircuitBreaker("gigachat")
+metrics.register("circuit_breaker", lambda: {"gigachat": gigachat_breaker.stats()})
@@ -0,0 +1,67 @@
+import functools
+import threading
+import time
+from app.common import IMPORT_BUDGET_MS, logger
+from app.common import metrics
+
+_lock = threading.Lock()
+_resources = {}
+_load_times = {}
+_import_time_ms = None
+
+
+def resource(factory):
+    """Создаёт объект при первом обращении и дальше отдаёт один и тот же экземпляр на весь процесс."""
+    name = f"{factory.__module__}.{factory.__qualname__}"
+    factory_lock = threading.Lock()
+
+    @functools.wraps(factory)
+    def get():
+        if name in _resources:
+            return _resources[name]
+        with factory_lock:
+            if name not in _resources:
+                started = time.perf_counter()
+                value = factory()
+                _load_times[name] = round((time.perf_counter() - started) * 1000, 1)
+                logger.info(f"Resource {name} loaded in {_load_times[name]} ms")
+                with _lock:
+                    _resources[name] = value
+        return _resources[name]
+
+    def reset(value):
+        # Выбрасывает сломанный экземпляр, если его ещё не заменили: следующее обращение создаст новый
+        with factory_lock:
+            if _resources.get(name) is not value:
+                return False
+            with _lock:
+                del _resources[name]
+        logger.info(f"Resource {name} reset")
+        return True
+
+    get.loaded = lambda: name in _resources
+    get.reset = reset
+    return get
+
+
+def report_import_time(seconds):
+    global _import_time_ms
+    # Streamlit перезапускает скрипт, но модули импортируются один раз на процесс
+    if _import_time_ms is not None:
+        return
+    _import_time_ms = round(seconds * 1000, 1)
+    if _import_time_ms > IMPORT_BUDGET_MS:
+        logger.warning(f"Import time {_import_time_ms} ms exceeds budget of {IMPORT_BUDGET_MS} ms")
+    else:
+        logger.info(f"Import time {_import_time_ms} ms (budget {IMPORT_BUDGET_MS} ms)")
+
+
+def stats():
+    return {
+        "import_time_ms": _import_time_ms,
+        "import_budget_ms": IMPORT_BUDGET_MS,
+        "loaded": dict(_load_times),
+    }
+
+
+metrics.register("resources", stats)
@@ -0,0 +1,91 @@
+import functools
+import re
+from dataclasses import dataclass
+from typing import Optional
+from app.common import ROUTER_CLASSIFIER, logger
+from app.common import metrics
+
+# Маршруты совпадают с именами инструментов, "chat" - обычный ответ модели
+SEARCH = "paper_search"
+READ = "pdf_reader"
+BIBTEX = "generate_paper_bibtex"
+PAPER_QA = "paper_qa"
+CONTACTS = "author_contacts"
+CHAT = "chat"
+
+URL_RE = re.compile(r"https?://[^\s<>\"')\]]+")
+# Номер статьи в списке поиска - одна-две цифры: "статьи 2020 года" номером не считается
+PAPER_NUMBER_RE = re.compile(r"(?:№|номер|#)\s*(\d{1,2})(?!\d)|стать[а-яё]*\s+(\d{1,2})(?!\d)")
+
+# Порядок важен: "Сгенерируй BibTeX для статьи №1" тоже упоминает статью. Слова вроде "библиографический"
+# или "почта" бывают темой поиска, поэтому BibTeX и контакты узнаём только по самой просьбе
+PATTERNS = [
+    (BIBTEX, re.compile(r"bibtex|бибтекс|\b(сгенерируй|сформируй|составь|оформи|создай|сделай|напиши)\b"
+                        r".*\b(библиограф|цитировани|ссылк)")),
+    (CONTACTS, re.compile(r"\b(e-?mail|почт[аыуе]|контакт[а-яё]*|связаться)\b.*\bавтор"
+                          r"|\bавтор[а-яё]*\b.*\b(e-?mail|почт[аыуе]|контакт[а-яё]*)\b")),
+    (SEARCH, re.compile(r"\b(найди|найти|поищи|подбери|ищи)\b.*\b(стать|публикац|работ|исследован)")),
+    (READ, re.compile(r"\b(прочитай|прочти|прочесть|опиши|перескажи|суммаризируй)\b.*\b(стать|документ|pdf|публикац)")),
+    (PAPER_QA, re.compile(r"\b(вывод|результат|метод|заключени|аннотаци)[а-яё]*\b.*\bстать")),
+]
+# После чтения статьи уточняющие вопросы ("Какие выводы?") относятся к ней, даже без слова "статья"
+SECTION_QUESTION_RE = re.compile(r"\b(вывод|результат|метод|методик|заключени|аннотаци|итог|эксперимент)[а-яё]*\b")
+
+CLASSIFIER_PROMPT = """Определи намерение пользователя и верни только одну метку из списка:
+paper_search - поиск научных статей
+pdf_reader - прочитать или пересказать статью
+generate_paper_bibtex - сгенерировать BibTeX
+paper_qa - вопрос о содержании статьи
+author_contacts - контакты авторов
+chat - всё остальное
+
+Сообщение: {prompt}"""
+
+
+@dataclass(frozen=True)
+class Route:
+    name: str
+    query: str
+    url: Optional[str] = None
+    paper_number: Optional[int] = None
+
+
+def _normalize(prompt):
+    return " ".join(prompt.lower().replace("ё", "е").split())
+
+
+@functools.lru_cache(maxsize=1024)
+def _classify(normalized_prompt):
+    from app.common.completions import giga_chat
+
+    label = giga_chat(CLASSIFIER_PROMPT.format(prompt=normalized_prompt), max_tokens=10)
+    label = label.strip().strip('"`.').lower()
+    return label if label in (SEARCH, READ, BIBTEX, PAPER_QA, CONTACTS) else CHAT
+
+
+def route(prompt, paper_in_context=False):
+    """Выбирает ровно один обработчик для сообщения до обращения к модели.
+
+    paper_in_context - в сессии уже прочитана статья, и вопросы о её разделах отвечаются по ней."""
+    normalized = _normalize(prompt)
+    url_match = URL_RE.search(prompt)
+    url = url_match.group(0).rstrip(".,;:!?") if url_match else None
+    number_match = PAPER_NUMBER_RE.search(normalized)
+    paper_number = int(next(g for g in number_match.groups() if g)) if number_match else None
+
+    name = next((route_name for route_name, pattern in PATTERNS if pattern.search(normalized)), None)
+    if name is None and paper_in_context and SECTION_QUESTION_RE.search(normalized):
+        name = PAPER_QA
+    if name is None and url is not None:
+        # Голая ссылка - просим прочитать документ
+        name = READ
+    if name is None and ROUTER_CLASSIFIER:
+        try:
+            name = _classify(normalized)
+        except Exception as e:
+            logger.error(f"Intent classifier failed: {e}")
+    name = name or CHAT
+
+    metrics.incr(f"router.{name}")
+    logger.info(f"Routing prompt to {name} (url={url}, paper_number={paper_number})")
+    return Route(name=name, query=prompt, url=url, paper_number=paper_number)
@@ -0,0 +1,92 @@
+import re
+from dataclasses import dataclass
+from typing import List, Optional
+from app.common import logger
+
+ABSTRACT = "abstract"
+INTRODUCTION = "introduction"
+METHODS = "methods"
+RESULTS = "results"
+CONCLUSIONS = "conclusions"
+REFERENCES = "references"
+
+# Заголовки разделов русских и английских статей
+HEADINGS = {
+    ABSTRACT: r"аннотация|резюме|abstract|summary",
+    INTRODUCTION: r"введение|introduction",
+    METHODS: r"материалы\s+и\s+методы|методы(?:\s+исследования)?|методика(?:\s+исследования)?|методология"
+             r"|materials\s+and\s+methods|methods|methodology",
+    RESULTS: r"результаты(?:\s+(?:и\s+обсуждение|исследования))?|обсуждение(?:\s+результатов)?"
+             r"|results(?:\s+and\s+discussion)?|discussion",
+    CONCLUSIONS: r"выводы|заключение|conclusions?",
+    REFERENCES: r"список\s+(?:литературы|источников|использованных\s+источников)|литература"
+                r"|библиографический\s+список|references|bibliography",
+}
+
+# Заголовок - отдельная строка, возможно с номером ("2.", "II."), либо начало строки с двоеточием или точкой
+# после него ("Аннотация. В статье..."). Один проход регулярным выражением по всему тексту
+_HEADING = re.compile(
+    r"^[ \t]*(?:\d+(?:\.\d+)*\.?|[IVX]+\.)?[ \t]*(?:"
+    + "|".join(f"(?P<{name}>{pattern})" for name, pattern in HEADINGS.items())
+    + r")[ \t]*(?:$|[.:—–-])",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+# Слова в вопросе пользователя, указывающие на раздел
+QUESTION_SECTIONS = [
+    (CONCLUSIONS, re.compile(r"вывод|заключени|итог|conclusion")),
+    (RESULTS, re.compile(r"результат|обсужден|result")),
+    (METHODS, re.compile(r"метод|методик|подход|эксперимент|данны[ехм]|method")),
+    (INTRODUCTION, re.compile(r"введени|актуальност|цел[ьи]\b|задач|introduction")),
+    (ABSTRACT, re.compile(r"аннотаци|кратко|о ч[её]м|abstract")),
+    (REFERENCES, re.compile(r"литератур|источник|ссылк|reference")),
+]
+
+
+@dataclass(frozen=True)
+class Section:
+    name: str
+    title: str
+    start: int
+    end: int
+
+    def text(self, document):
+        return document[self.start:self.end]
+
+    def as_dict(self):
+        return {"name": self.name, "title": self.title, "start": self.start, "end": self.end}
+
+
+def segment_sections(text) -> List[Section]:
+    """Разделы статьи со смещениями в символах. Раздел длится до заголовка следующего найденного раздела.
+
+    Учитывается первый заголовок каждого вида: повторы обычно означают англоязычную аннотацию в конце статьи."""
+    headings = []
+    seen = set()
+    for match in _HEADING.finditer(text):
+        name = match.lastgroup
+        # Перенос строки посреди предложения ("получены\nрезультаты. Далее") заголовком не считаем
+        if name in seen or not match.group(name)[0].isupper():
+            continue
+        # После начала списка литературы заголовков разделов уже нет
+        if REFERENCES in seen:
+            break
+        seen.add(name)
+        headings.append((match.start(), name, match.group(name)))
+
+    sections = [
+        Section(name, " ".join(title.split()), start, headings[index + 1][0] if index + 1 < len(headings) else len(text))
+        for index, (start, name, title) in enumerate(headings)
+    ]
+    logger.info(f"Found sections: {', '.join(section.name for section in sections) or 'none'}")
+    return sections
+
+
+def section_for_question(question, sections) -> Optional[Section]:
+    """Раздел, к которому относится вопрос, если он в статье найден."""
+    by_name = {section.name: section for section in sections}
+    normalized = question.lower()
+    for name, pattern in QUESTION_SECTIONS:
+        if pattern.search(normalized) and name in by_name:
+            return by_name[name]
+    return None
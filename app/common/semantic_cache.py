@@ -0,0 +1,161 @@
+import threading
+import time
+from typing import List, Optional
+import numpy as np
+from app.common import AUTH_DATA, MODEL, SCOPE, SEMANTIC_CACHE_SIZE, SEMANTIC_THRESHOLDS, SDK_TIMEOUT, estimate_tokens, logger
+from app.common import metrics
+from app.common.auth import token_manager
+from app.common.deadline import bounded
+from app.common.ratelimit import rate_limiter
+from app.common.resilience import gigachat_breaker
+from app.common.resources import resource
+from app.common.transport import share_pool
+
+
+@resource
+def embeddings_client():
+    from langchain_gigachat import GigaChatEmbeddings
+
+    embeddings = GigaChatEmbeddings(
+        credentials=AUTH_DATA,
+        scope=SCOPE,
+        verify_ssl_certs=False,
+        timeout=SDK_TIMEOUT
+    )
+    token_manager.attach(embeddings._client)
+    share_pool(embeddings._client)
+    return embeddings
+
+
+# Насколько близким должен быть вопрос, чтобы отдать его ответ, когда GigaChat недоступен
+FALLBACK_THRESHOLD = 0.85
+
+
+def _normalize(prompt):
+    return " ".join(prompt.lower().split())
+
+
+class SemanticLookup:
+    def __init__(self, route, prompt, embedding, answer=None):
+        self.route = route
+        self.prompt = prompt
+        self.embedding = embedding
+        self.answer = answer
+
+
+class SemanticIndex:
+    """Матрица нормированных эмбеддингов фиксированного размера с вытеснением давно не использованных строк."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.vectors: Optional[np.ndarray] = None
+        self.answers: List[Optional[dict]] = [None] * capacity
+        self.last_used = np.zeros(capacity)
+        self.size = 0
+
+    def search(self, query):
+        if self.size == 0:
+            return None, 0.0
+        scores = self.vectors[:self.size] @ query
+        best = int(np.argmax(scores))
+        return best, float(scores[best])
+
+    def add(self, vector, entry):
+        if self.vectors is None:
+            self.vectors = np.zeros((self.capacity, vector.shape[0]), dtype=np.float32)
+        if self.size < self.capacity:
+            row = self.size
+            self.size += 1
+        else:
+            row = int(np.argmin(self.last_used))
+        self.vectors[row] = vector
+        self.answers[row] = entry
+        self.last_used[row] = time.monotonic()
+
+
+class SemanticCache:
+    def __init__(self, capacity=SEMANTIC_CACHE_SIZE, thresholds=SEMANTIC_THRESHOLDS, embed=None):
+        self.capacity = capacity
+        self.thresholds = thresholds
+        self._embed = embed
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self.saved_tokens = 0
+
+    def _embedding(self, text):
+        embed = self._embed or embeddings_client().embed_query
+        # Эмбеддинги считает тот же GigaChat: при разомкнутом breaker не ждём таймаутов сбоящего сервиса
+        embedding = gigachat_breaker.call(
+            lambda: rate_limiter.call(lambda: bounded(lambda: embed(text)), tokens=estimate_tokens(text))
+        )
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, route, prompt) -> SemanticLookup:
+        embedding = self._embedding(prompt)
+        lookup = SemanticLookup(route, prompt, embedding)
+        with self._lock:
+            index = self._indexes.get(route)
+            row, score = index.search(embedding) if index else (None, 0.0)
+            if row is not None and score >= self.thresholds.get(route, 1.0):
+                entry = index.answers[row]
+                index.last_used[row] = time.monotonic()
+                self.hits += 1
+                self.saved_seconds += entry["latency"]
+                self.saved_tokens += entry["tokens"]
+                lookup.answer = entry["answer"]
+                logger.info(f"Semantic cache hit for route {route} (similarity {score:.3f})")
+            else:
+                self.misses += 1
+        metrics.incr(f"semantic_cache.{'hits' if lookup.answer is not None else 'misses'}")
+        return lookup
+
+    def closest(self, route, prompt, lookup=None, threshold=FALLBACK_THRESHOLD):
+        """Ближайший сохранённый ответ с пониженным порогом - запасной вариант при отказе upstream.
+
+        Без эмбеддинга запроса (его не посчитать, пока GigaChat недоступен) ищется тот же вопрос дословно."""
+        with self._lock:
+            index = self._indexes.get(route)
+            if index is None:
+                return None
+            if lookup is not None:
+                row, score = index.search(lookup.embedding)
+                if row is None or score < threshold:
+                    return None
+                entry = index.answers[row]
+            else:
+                normalized = _normalize(prompt)
+                entry = next((entry for entry in index.answers[:index.size] if entry["prompt"] == normalized), None)
+                if entry is None:
+                    return None
+            metrics.incr("semantic_cache.fallbacks")
+            return entry["answer"]
+
+    def store(self, lookup, answer, latency):
+        entry = {
+            "prompt": _normalize(lookup.prompt),
+            "answer": answer,
+            "latency": latency,
+            "tokens": estimate_tokens(lookup.prompt) + estimate_tokens(answer),
+            "model": MODEL,
+        }
+        with self._lock:
+            index = self._indexes.setdefault(lookup.route, SemanticIndex(self.capacity))
+            index.add(lookup.embedding, entry)
+
+    def stats(self):
+        return {
+            "entries": {route: index.size for route, index in self._indexes.items()},
+            "hits": self.hits,
+            "misses": self.misses,
+            "saved_seconds": round(self.saved_seconds, 2),
+            "saved_tokens": self.saved_tokens,
+        }
+
+
+semantic_cache = SemanticCache()
+metrics.register("semantic_cache", semantic_cache.stats)
@@ -0,0 +1,149 @@
+import asyncio
+import threading
+import time
+import weakref
+from app.common import logger
+from app.common import metrics
+from app.common.deadline import CANCEL_POLL_INTERVAL, check_cancelled, is_turn_scoped
+
+
+class LeaderAbandoned(Exception):
+    """Лидер бросил вызов по причине, касающейся только его реплики: ожидающий повторяет вызов сам."""
+
+
+class Call:
+    def __init__(self):
+        self._done = threading.Event()
+        self.result = None
+        self.error = None
+        self.abandoned = False
+        self.waiters = 0
+
+    def ready(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def wait(self, timeout=None):
+        # Ждём частями, чтобы отмена собственной реплики ожидающего не ждала лидера
+        wait_until = None if timeout is None else time.monotonic() + timeout
+        while not self._done.wait(CANCEL_POLL_INTERVAL if wait_until is None
+                                  else max(min(CANCEL_POLL_INTERVAL, wait_until - time.monotonic()), 0.0)):
+            check_cancelled()
+            if wait_until is not None and time.monotonic() >= wait_until:
+                raise TimeoutError("Timed out waiting for the in-flight request")
+        if self.abandoned:
+            raise LeaderAbandoned()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight:
+    """Схлопывает одинаковые одновременные вызовы: upstream вызывается один раз, результат получают все."""
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._async_calls = weakref.WeakKeyDictionary()
+        self.leaders = 0
+        self.collapsed = 0
+        self.abandoned = 0
+
+    def begin(self, key):
+        """Возвращает (call, is_leader). Лидер обязан завершить вызов через finish()."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.collapsed += 1
+                metrics.incr(f"singleflight.{self.name}.collapsed")
+                return call, False
+            call = Call()
+            self._calls[key] = call
+            self.leaders += 1
+            return call, True
+
+    def finish(self, key, call, result=None, error=None):
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+            if error is not None and is_turn_scoped(error):
+                # Ожидающим передаём только настоящие ошибки upstream, остальные повторят вызов
+                call.abandoned = True
+                self.abandoned += 1
+        call.result = result
+        call.error = None if call.abandoned else error
+        call._done.set()
+        if call.waiters:
+            if call.abandoned:
+                logger.info(f"Single-flight {self.name}: leader gave up ({type(error).__name__}), "
+                            f"{call.waiters} waiting requests will retry")
+            else:
+                logger.info(f"Single-flight {self.name}: {call.waiters} identical requests shared one upstream call")
+
+    def do(self, key, fn, timeout=None):
+        wait_until = None if timeout is None else time.monotonic() + timeout
+        while True:
+            call, leader = self.begin(key)
+            if leader:
+                break
+            try:
+                return call.wait(None if wait_until is None else max(wait_until - time.monotonic(), 0.0))
+            except LeaderAbandoned:
+                continue
+        try:
+            result = fn()
+        except BaseException as e:
+            self.finish(key, call, error=e)
+            raise
+        self.finish(key, call, result=result)
+        return result
+
+    async def ado(self, key, coro_fn):
+        # Future привязана к event loop, поэтому асинхронные вызовы схлопываются в пределах одного loop
+        calls = self._async_calls.setdefault(asyncio.get_running_loop(), {})
+        while True:
+            future = calls.get(key)
+            if future is None:
+                break
+            self.collapsed += 1
+            metrics.incr(f"singleflight.{self.name}.collapsed")
+            try:
+                return await asyncio.shield(future)
+            except LeaderAbandoned:
+                continue
+
+        future = asyncio.get_running_loop().create_future()
+        calls[key] = future
+        self.leaders += 1
+        try:
+            result = await coro_fn()
+        except BaseException as e:
+            # В том числе CancelledError лидера: иначе ожидающие так и не дождутся future
+            if is_turn_scoped(e):
+                self.abandoned += 1
+                future.set_exception(LeaderAbandoned())
+            else:
+                future.set_exception(e)
+            # Исключение уже передано лидеру, ожидающих может и не быть
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            calls.pop(key, None)
+
+    def stats(self):
+        total = self.leaders + self.collapsed
+        return {
+            "upstream_calls": self.leaders,
+            "collapsed": self.collapsed,
+            "abandoned": self.abandoned,
+            "in_flight": len(self._calls),
+            "collapse_rate": round(self.collapsed / total, 3) if total else None,
+        }
+
+
+chat_flight = SingleFlight("chat")
+metrics.register("singleflight", lambda: {"chat": chat_flight.stats()})
@@ -45,4 +45,11 @@ COMMAND_EXAMPLES = """
 
 EXAMPLE_PAPER = """[Пример статьи](https://cyberleninka.ru/article/n/uvelichenie-tochnosti-bolshih-yazykovyh-modeley-s-pomoschyu-rasshirennoy-poiskovoy-generatsii/pdf)"""
 
-PROMPT_APPENDIX = ". Ищи данные в диалоге в первую очередь." 
\ No newline at end of file
+PROMPT_APPENDIX = ". Ищи данные в диалоге в первую очередь." 
+PARTIAL_ANSWER = "\n\n_Ответ неполный: истекло время ожидания._"
+
+DEADLINE_EXCEEDED = "Не успел ответить за отведённое время. Попробуйте повторить запрос или сузить вопрос."
+
+STALE_ANSWER = "\n\n_GigaChat временно недоступен, поэтому показан ответ на похожий вопрос из кэша._"
+
+SERVICE_UNAVAILABLE = "GigaChat временно недоступен. Пожалуйста, повторите запрос через минуту."
@@ -0,0 +1,128 @@
+import asyncio
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+from app.common import (
+    DOC_SUMMARY_CHUNK_TOKENS, DOC_SUMMARY_CONCURRENCY, DOC_SUMMARY_FANOUT, DOC_SUMMARY_MAX_TOKENS, EXTRACTIVE_SUMMARY,
+    EXTRACTIVE_SUMMARY_TOKENS, PROMPT_PATH, estimate_tokens, logger
+)
+from app.common import metrics
+from app.common.aio import async_client
+from app.common.completions import giga_chat
+from app.common.extractive import extract_key_sentences
+from app.common.ratelimit import BATCH
+from app.common.resources import resource
+
+# Перекрытие соседних фрагментов, чтобы мысль на границе не терялась
+CHUNK_OVERLAP_TOKENS = 100
+# Длина промежуточных кратких содержаний: фрагмента и группы фрагментов
+PARTIAL_SUMMARY_SIZE = "2-3 предложения"
+PARTIAL_SUMMARY_MAX_TOKENS = 256
+
+_executor = ThreadPoolExecutor(max_workers=DOC_SUMMARY_CONCURRENCY, thread_name_prefix="summary")
+
+
+@resource
+def summary_prompt():
+    from langchain.prompts import load_prompt
+
+    return load_prompt(os.path.join(PROMPT_PATH, "summary.yaml"))
+
+
+@resource
+def text_splitter():
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    return RecursiveCharacterTextSplitter(
+        chunk_size=DOC_SUMMARY_CHUNK_TOKENS,
+        chunk_overlap=CHUNK_OVERLAP_TOKENS,
+        length_function=estimate_tokens,
+        separators=["\n\n", "\n", ". ", " ", ""],
+    )
+
+
+def document_chunks(text, max_tokens=DOC_SUMMARY_MAX_TOKENS, extractive=EXTRACTIVE_SUMMARY):
+    """Фрагменты документа по DOC_SUMMARY_CHUNK_TOKENS токенов, всего не больше max_tokens.
+
+    С extractive документ сначала сжимается до EXTRACTIVE_SUMMARY_TOKENS отбором ключевых предложений.
+    Если документ длиннее потолка, берутся равномерно расположенные фрагменты, включая первый и последний."""
+    if extractive:
+        text = extract_key_sentences(text, EXTRACTIVE_SUMMARY_TOKENS)
+    chunks = [chunk for chunk in text_splitter().split_text(text) if chunk.strip()]
+    total = sum(estimate_tokens(chunk) for chunk in chunks)
+    if total <= max_tokens:
+        return chunks
+
+    keep = max(int(max_tokens / (total / len(chunks))), 1)
+    step = (len(chunks) - 1) / (keep - 1) if keep > 1 else 0
+    indexes = sorted({round(i * step) for i in range(keep)})
+    metrics.incr("summary.dropped_chunks", len(chunks) - len(indexes))
+    logger.info(f"Document has ~{total} tokens, summarizing {len(indexes)} of {len(chunks)} chunks")
+    return [chunks[index] for index in indexes]
+
+
+def _prompt(text, size=None):
+    if size is None:
+        return summary_prompt().format(text=text)
+    return summary_prompt().format(text=text, combine_size=size)
+
+
+def _groups(summaries, fanout):
+    return ["\n\n".join(summaries[start:start + fanout]) for start in range(0, len(summaries), fanout)]
+
+
+def _map(fn, items):
+    # Каждому потоку своя копия контекста, чтобы дедлайн реплики действовал и во фрагментах
+    futures = [_executor.submit(contextvars.copy_context().run, fn, item) for item in items]
+    try:
+        return [future.result() for future in futures]
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+
+
+def _partial(text):
+    # Промежуточные вызовы уступают лимит интерактивным запросам других пользователей
+    return giga_chat(_prompt(text, PARTIAL_SUMMARY_SIZE), PARTIAL_SUMMARY_MAX_TOKENS, priority=BATCH)
+
+
+def summarize_document(text, fanout=DOC_SUMMARY_FANOUT, extractive=EXTRACTIVE_SUMMARY):
+    """Краткое содержание всего документа: фрагменты параллельно, затем иерархическая свёртка по fanout штук."""
+    chunks = document_chunks(text, extractive=extractive)
+    if not chunks:
+        return ""
+    metrics.incr("summary.chunks", len(chunks))
+
+    summaries = chunks if len(chunks) == 1 else _map(_partial, chunks)
+    levels = 0
+    fanout = max(fanout, 2)
+    while len(summaries) > fanout:
+        summaries = _map(_partial, _groups(summaries, fanout))
+        levels += 1
+    metrics.observe("summary.reduce_levels", levels)
+    return giga_chat(_prompt("\n\n".join(summaries)))
+
+
+async def asummarize_document(text, fanout=DOC_SUMMARY_FANOUT, extractive=EXTRACTIVE_SUMMARY):
+    # Отбор предложений нагружает процессор, поэтому не держим им event loop
+    chunks = await asyncio.to_thread(document_chunks, text, extractive=extractive)
+    if not chunks:
+        return ""
+    metrics.incr("summary.chunks", len(chunks))
+    semaphore = asyncio.Semaphore(DOC_SUMMARY_CONCURRENCY)
+
+    async def partial(text):
+        async with semaphore:
+            return await async_client.chat_prompt(
+                _prompt(text, PARTIAL_SUMMARY_SIZE), PARTIAL_SUMMARY_MAX_TOKENS, priority=BATCH
+            )
+
+    summaries = chunks if len(chunks) == 1 else await asyncio.gather(*(partial(chunk) for chunk in chunks))
+    levels = 0
+    fanout = max(fanout, 2)
+    while len(summaries) > fanout:
+        summaries = await asyncio.gather(*(partial(group) for group in _groups(summaries, fanout)))
+        levels += 1
+    metrics.observe("summary.reduce_levels", levels)
+    return await async_client.chat_prompt(_prompt("\n\n".join(summaries)))
@@ -1,19 +1,126 @@
 import os
-import glob
+import asyncio
 import requests
-import PyPDF2
 from langchain.pydantic_v1 import BaseModel, Field
 from langchain.tools import BaseTool
-from typing import Type, Any, Dict, List, Optional, ClassVar
-from langchain.document_loaders import DirectoryLoader
-from langchain.text_splitter import (
-    RecursiveCharacterTextSplitter,
-)
-from langchain.prompts import load_prompt
-from langchain_community.chat_models import GigaChat as LangchainGigaChat
-from langchain_gigachat import GigaChatEmbeddings
-from app.common import AUTH_DATA, DATA_PATH, PROMPT_PATH, CYBERLENINKA_SIZE, TOP_K_PAPERS, headers, save_file, save_json, top_k_similar, logger, TIMEOUT, MODEL, SCOPE, TEMPERATURE
-from gigachat import GigaChat
+from typing import Type, Optional, ClassVar
+from app.common import AUTH_DATA, DATA_PATH, PROMPT_PATH, CYBERLENINKA_SIZE, TOP_K_PAPERS, headers, save_file, save_json, top_k_similar, estimate_tokens, logger, PAPER_QA_MAX_TOKENS, SDK_TIMEOUT, MODEL, SCOPE, TEMPERATURE
+from app.common import metrics, steamlit_texts as TEXTS
+from app.common.aio import async_client
+from app.common.auth import token_manager
+from app.common.cache import make_key, response_cache
+from app.common.completions import giga_chat
+from app.common.deadline import LLM, DeadlineExceeded, bounded, timeout_for
+from app.common.extractive import extract_key_sentences
+from app.common.pdf import PdfDownloadError, clean_pdf_pages
+from app.common.pdf_cache import fetch_pdf_pages
+from app.common.prefetch import prefetch_search_results
+from app.common.ratelimit import rate_limiter
+from app.common.resilience import CircuitOpenError
+from app.common.resources import resource
+from app.common.sections import REFERENCES, section_for_question, segment_sections
+from app.common.summarize import asummarize_document, summarize_document
+from app.common.transport import share_pool
+
+
+# Тяжёлые клиенты и промпты создаются при первом обращении, а не при импорте модуля
+@resource
+def bibtex_giga():
+    from langchain_community.chat_models import GigaChat as LangchainGigaChat
+
+    giga = LangchainGigaChat(
+        credentials=AUTH_DATA,
+        verify_ssl_certs=False,
+        timeout=SDK_TIMEOUT,
+        model=MODEL,
+        scope=SCOPE,
+        temperature=TEMPERATURE
+    )
+    token_manager.attach(giga._client)
+    share_pool(giga._client)
+    return giga
+
+@resource
+def bibtex_chain():
+    from langchain.prompts import load_prompt
+
+    return load_prompt(os.path.join(PROMPT_PATH, "bibtex.yaml")) | bibtex_giga()
+
+def pdf_partial_answer(text, complete=True):
+    # Модель не успела ответить или недоступна - отдаём хотя бы начало статьи
+    note = "Не успел подготовить краткое содержание за отведённое время."
+    if not complete:
+        note += " Прочитаны не все страницы."
+    return {
+        "markdown": f"{note} Начало статьи:\n\n{text[:1000].strip()}",
+        "metadata": text,
+    }
+
+def pdf_error_answer(e):
+    # Ошибки загрузки и разбора PDF превращаются в понятный пользователю ответ
+    if isinstance(e, PdfDownloadError):
+        logger.error(f"Rejected PDF: {e}")
+        message = f"Ошибка при загрузке PDF: {e}"
+    elif isinstance(e, DeadlineExceeded):
+        logger.error(f"Deadline Error: {e}")
+        message = "Ошибка при загрузке PDF: Превышено время ожидания"
+    elif isinstance(e, requests.exceptions.HTTPError):
+        logger.error(f"Http Error: {e}")
+        message = "Ошибка при загрузке PDF: HTTP ошибка"
+    elif isinstance(e, requests.exceptions.ConnectionError):
+        logger.error(f"Error Connecting: {e}")
+        message = "Ошибка при загрузке PDF: Ошибка соединения"
+    elif isinstance(e, requests.exceptions.Timeout):
+        logger.error(f"Timeout Error: {e}")
+        message = "Ошибка при загрузке PDF: Превышено время ожидания"
+    elif isinstance(e, requests.exceptions.RequestException):
+        logger.error(f"Something went wrong with the request: {e}")
+        message = "Ошибка при загрузке PDF: Неизвестная ошибка"
+    else:
+        logger.error(f"Error processing PDF: {e}")
+        message = "Ошибка при обработке PDF файла"
+    return {
+        "markdown": message,
+        "metadata": ""
+    }
+
+def paper_fragment(question, text):
+    # Возвращает (текст для модели, заголовок раздела или None)
+    sections = segment_sections(text)
+    section = section_for_question(question, sections)
+    if section is not None:
+        metrics.incr(f"paper_qa.section.{section.name}")
+        return extract_key_sentences(section.text(text), PAPER_QA_MAX_TOKENS), section.title
+    # Подходящий раздел не найден - берём ключевые предложения статьи без списка литературы
+    metrics.incr("paper_qa.whole_text")
+    references = next((section for section in sections if section.name == REFERENCES), None)
+    body = text[:references.start] if references is not None else text
+    return extract_key_sentences(body, PAPER_QA_MAX_TOKENS), None
+
+def paper_question_prompt(question, fragment, title=None):
+    source = f"раздела «{title}» научной статьи" if title else "научной статьи"
+    return f"""Ответь на вопрос пользователя, опираясь только на текст {source}:
+
+            {fragment}
+
+            Вопрос: {question}"""
+
+def search_prompt(query):
+    # Формирование запроса
+    return f"""Найди научные статьи по запросу: {query}
+            Верни только список статей в формате:
+            1. Название статьи
+            Авторы
+            Год публикации
+            DOI или ссылка
+            Краткое описание (2-3 предложения)
+
+            2. [следующая статья...]"""
+
+
+def _bibtex_cache_key(paper_metadata):
+    # Цепочка LangChain идёт мимо giga_chat, поэтому кэшируем её ответ отдельно
+    return make_key(MODEL, "bibtex.yaml", [{"role": "user", "content": paper_metadata}], TEMPERATURE, None)
 
 
 class BibtexGeneratorInput(BaseModel):
@@ -27,16 +134,6 @@ class BibtexGeneratorTool(BaseTool):
     Выполняет генерацию представления и оформления библиографических ссылок и цитат по содержанию статьи в виде bibtex.
     """
     args_schema: ClassVar[Type[BaseModel]] = BibtexGeneratorInput
-    giga: ClassVar[LangchainGigaChat] = LangchainGigaChat(
-        credentials=AUTH_DATA,
-        verify_ssl_certs=False,
-        timeout=TIMEOUT,
-        model=MODEL,
-        scope=SCOPE,
-        temperature=TEMPERATURE
-    )
-    prompt: ClassVar[Any] = load_prompt(os.path.join(PROMPT_PATH, "bibtex.yaml"))
-    chain: ClassVar[Any] = prompt | giga
     return_direct: ClassVar[bool] = True
 
     def _run(
@@ -46,11 +143,41 @@ class BibtexGeneratorTool(BaseTool):
     ) -> str:
         logger.info(f"Paper metadata: {paper_metadata}")
 
-        result = self.chain.invoke(
-            {
-                "metadata": paper_metadata
-            }
-        ).content
+        cache_key = _bibtex_cache_key(paper_metadata)
+        result = response_cache.get(cache_key)
+        if result is None:
+            result = rate_limiter.call(lambda: bounded(lambda: bibtex_chain().invoke(
+                {
+                    "metadata": paper_metadata
+                }
+            )), tokens=estimate_tokens(paper_metadata) + 512).content
+            response_cache.put(cache_key, result)
+
+        return {
+           "markdown": result,
+           "metadata": paper_metadata,
+        }
+
+    async def _arun(
+        self,
+        paper_metadata: str="",
+        run_manager=None,
+    ) -> str:
+        logger.info(f"Paper metadata: {paper_metadata}")
+
+        cache_key = _bibtex_cache_key(paper_metadata)
+        result = response_cache.get(cache_key)
+        if result is None:
+            async def invoke():
+                async with async_client.slot():
+                    return await asyncio.wait_for(bibtex_chain().ainvoke(
+                        {
+                            "metadata": paper_metadata
+                        }
+                    ), timeout_for(LLM))
+
+            result = (await rate_limiter.acall(invoke, tokens=estimate_tokens(paper_metadata) + 512)).content
+            response_cache.put(cache_key, result)
 
         return {
            "markdown": result,
@@ -88,7 +215,6 @@ class PDFReaderTool(BaseTool):
     """
    args_schema: ClassVar[Type[BaseModel]] = PDFReaderInput
    return_direct: ClassVar[bool] = True
-   prompt: ClassVar[Any] = load_prompt(os.path.join(PROMPT_PATH, "summary.yaml"))
 
    def _run(
         self,
@@ -98,109 +224,174 @@ class PDFReaderTool(BaseTool):
         logger.info(f"PDF URL: {pdf_url}")
 
         try:
-            response = requests.get(pdf_url)
-            response.raise_for_status()
-        except requests.exceptions.HTTPError as errh:
-            logger.error(f"Http Error: {errh}")
+            # Тип и размер проверяются по заголовкам, уже прочитанные файлы берутся из кэша
+            pages, complete = fetch_pdf_pages(pdf_url)
+            text = clean_pdf_pages(pages)
+        except Exception as e:
+            return pdf_error_answer(e)
+
+        try:
+            # Получаем ответ от GigaChat
+            logger.info("Sending text to GigaChat for summarization")
+            try:
+                summary = summarize_document(text)
+            except (TimeoutError, CircuitOpenError) as e:
+                logger.error(f"PDF summary timed out: {e}")
+                return pdf_partial_answer(text, complete)
+            logger.info("Received summary from GigaChat")
+
             return {
-                "markdown": "Ошибка при загрузке PDF: HTTP ошибка",
-                "metadata": ""
+                "markdown": summary,
+                "metadata": text,
+                "sections": [section.as_dict() for section in segment_sections(text)],
             }
-        except requests.exceptions.ConnectionError as errc:
-            logger.error(f"Error Connecting: {errc}")
+        except Exception as e:
+            logger.error(f"Error processing PDF: {e}")
             return {
-                "markdown": "Ошибка при загрузке PDF: Ошибка соединения",
+                "markdown": "Ошибка при обработке PDF файла",
                 "metadata": ""
             }
-        except requests.exceptions.Timeout as errt:
-            logger.error(f"Timeout Error: {errt}")
+
+   async def _arun(
+        self,
+        pdf_url: str="",
+        run_manager=None,
+    ) -> str:
+        logger.info(f"PDF URL: {pdf_url}")
+
+        try:
+            # Загрузка и разбор блокирующие, поэтому не держим ими event loop
+            pages, complete = await asyncio.to_thread(fetch_pdf_pages, pdf_url)
+            text = clean_pdf_pages(pages)
+        except Exception as e:
+            return pdf_error_answer(e)
+
+        try:
+            try:
+                summary = await asummarize_document(text)
+            except (TimeoutError, asyncio.TimeoutError, CircuitOpenError) as e:
+                logger.error(f"PDF summary timed out: {e}")
+                return pdf_partial_answer(text, complete)
             return {
-                "markdown": "Ошибка при загрузке PDF: Превышено время ожидания",
-                "metadata": ""
+                "markdown": summary,
+                "metadata": text,
+                "sections": [section.as_dict() for section in segment_sections(text)],
             }
-        except requests.exceptions.RequestException as err:
-            logger.error(f"Something went wrong with the request: {err}")
+        except Exception as e:
+            logger.error(f"Error processing PDF: {e}")
             return {
-                "markdown": "Ошибка при загрузке PDF: Неизвестная ошибка",
+                "markdown": "Ошибка при обработке PDF файла",
                 "metadata": ""
             }
 
-        try:
-            # download and read the file
-            with open('temp.pdf', 'wb') as f:
-                f.write(response.content)
-
-            with open('temp.pdf', 'rb') as pdf_file:
-                read_pdf = PyPDF2.PdfReader(pdf_file)
-                number_of_pages = len(read_pdf.pages)
-                text = ""
-                for page_number in range(number_of_pages):   
-                    page = read_pdf.pages[page_number]
-                    text += page.extract_text()
-
-            # Получаем глобальный экземпляр GigaChat
-            from app.common import giga
-
-            # Формируем промпт для суммаризации
-            prompt = f"""Прочитай следующий текст научной статьи и предоставь краткое содержание:
+class PaperQAInput(BaseModel):
+    question: str = Field(
+        description="вопрос пользователя о содержании статьи"
+    )
+    pdf_url: str = Field(
+        description="ссылка на PDF документ"
+    )
 
-            {text[100:600] + text[-600:-100]}
+class PaperQATool(BaseTool):
+    name: ClassVar[str] = "paper_qa"
+    description: ClassVar[str] = """
+    Отвечает на вопрос о содержании уже прочитанной статьи: выводах, результатах, методах.
+    В модель отправляется только раздел статьи, к которому относится вопрос.
+    """
+    args_schema: ClassVar[Type[BaseModel]] = PaperQAInput
+    return_direct: ClassVar[bool] = True
 
-            Пожалуйста, выдели основные моменты, ключевые идеи и выводы."""
+    def _run(
+        self,
+        question: str="",
+        pdf_url: str="",
+        run_manager=None,
+    ) -> str:
+        logger.info(f"Question about PDF {pdf_url}: {question}")
 
-            # Получаем ответ от GigaChat
-            logger.info("Sending text to GigaChat for summarization")
-            response = giga.chat(prompt)
-            logger.info("Received summary from GigaChat")
+        try:
+            # Статья обычно уже прочитана, и с PDF_CACHE текст берётся из кэша без загрузки
+            pages, _ = fetch_pdf_pages(pdf_url)
+            fragment, title = paper_fragment(question, clean_pdf_pages(pages))
+        except Exception as e:
+            return pdf_error_answer(e)
 
+        try:
+            answer = giga_chat(paper_question_prompt(question, fragment, title))
+        except TimeoutError as e:
+            logger.error(f"Paper question timed out: {e}")
             return {
-                "markdown": response.choices[0].message.content,
-                "metadata": text,
+                "markdown": TEXTS.DEADLINE_EXCEEDED,
+                "metadata": fragment,
             }
+        return {
+            "markdown": answer,
+            "metadata": fragment,
+        }
+
+    async def _arun(
+        self,
+        question: str="",
+        pdf_url: str="",
+        run_manager=None,
+    ) -> str:
+        logger.info(f"Question about PDF {pdf_url}: {question}")
+
+        try:
+            pages, _ = await asyncio.to_thread(fetch_pdf_pages, pdf_url)
+            fragment, title = await asyncio.to_thread(paper_fragment, question, clean_pdf_pages(pages))
         except Exception as e:
-            logger.error(f"Error processing PDF: {e}")
+            return pdf_error_answer(e)
+
+        try:
+            answer = await async_client.chat_prompt(paper_question_prompt(question, fragment, title))
+        except (TimeoutError, asyncio.TimeoutError) as e:
+            logger.error(f"Paper question timed out: {e}")
             return {
-                "markdown": "Ошибка при обработке PDF файла",
-                "metadata": ""
+                "markdown": TEXTS.DEADLINE_EXCEEDED,
+                "metadata": fragment,
             }
-        finally:
-            # Cleanup temporary file
-            if os.path.exists('temp.pdf'):
-                try:
-                    os.remove('temp.pdf')
-                except Exception as e:
-                    logger.error(f"Error removing temporary file: {e}")
+        return {
+            "markdown": answer,
+            "metadata": fragment,
+        }
 
 class SearchPaperTool(BaseTool):
     name: ClassVar[str] = "paper_search"
     description: ClassVar[str] = "Поиск научных статей по заданному запросу. Используется только для поиска статей, не для их анализа или суммаризации."
 
-    def _run(self, query: str) -> str:
+    def _run(self, query: str, prefetch_memory: Optional[dict] = None) -> str:
         try:
-            from app.common import giga
-
-            # Формирование запроса
-            prompt = f"""Найди научные статьи по запросу: {query}
-            Верни только список статей в формате:
-            1. Название статьи
-            Авторы
-            Год публикации
-            DOI или ссылка
-            Краткое описание (2-3 предложения)
-
-            2. [следующая статья...]"""
-
             # Получение ответа
             logger.info(f"Sending search query: {query}")
-            response = giga.chat(prompt)
+            response = giga_chat(search_prompt(query))
             logger.info("Received response from GigaChat")
-            return response.choices[0].message.content
+            # Следующей репликой обычно просят прочитать одну из статей - качаем их заранее
+            prefetch_search_results(response, prefetch_memory)
+            return response
 
+        except CircuitOpenError:
+            # Запасной ответ подбирает вызывающий код (например, из семантического кэша)
+            raise
         except Exception as e:
             logger.error(f"Error in paper search: {str(e)}")
             logger.error(f"Error type: {type(e)}")
             logger.error(f"Error details: {e.__dict__ if hasattr(e, '__dict__') else 'No details available'}")
             return f"Ошибка при поиске статей: {str(e)}"
 
-    def _arun(self, query: str) -> str:
-        raise NotImplementedError("Async not implemented")
\ No newline at end of file
+    async def _arun(self, query: str, prefetch_memory: Optional[dict] = None) -> str:
+        try:
+            logger.info(f"Sending search query: {query}")
+            response = await async_client.chat_prompt(search_prompt(query))
+            prefetch_search_results(response, prefetch_memory)
+            return response
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error(f"Error in paper search: {str(e)}")
+            return f"Ошибка при поиске статей: {str(e)}"
+
+@resource
+def default_tools():
+    tools = [SearchPaperTool(), PDFReaderTool(), PaperQATool(), BibtexGeneratorTool()]
+    return {tool.name: tool for tool in tools}
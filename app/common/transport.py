@@ -0,0 +1,106 @@
+import threading
+from collections import Counter
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from app.common import BASE_URL, HTTP2, HTTP_POOL_HOSTS, HTTP_POOL_SIZE, SDK_TIMEOUT, logger
+from app.common import metrics
+
+_lock = threading.Lock()
+_requests_by_host = Counter()
+
+
+def _count_request(response, *args, **kwargs):
+    with _lock:
+        _requests_by_host[urlsplit(response.url).netloc] += 1
+
+
+def _build_session():
+    session = requests.Session()
+    # pool_maxsize ограничивает число keep-alive соединений на один хост. Сверх него соединения открываются
+    # на один запрос и закрываются: ожидание свободного соединения в пуле requests ничем не ограничено
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_SIZE, pool_block=False)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.verify = False
+    session.hooks["response"].append(_count_request)
+    return session
+
+
+def _http2_available():
+    if not HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logger.warning("HTTP2 is enabled but the h2 package is not installed, falling back to HTTP/1.1")
+        return False
+    return True
+
+
+def _build_gigachat_client(http2):
+    import httpx
+
+    return httpx.Client(
+        base_url=BASE_URL,
+        verify=False,
+        timeout=httpx.Timeout(SDK_TIMEOUT),
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=HTTP_POOL_SIZE,
+            max_keepalive_connections=HTTP_POOL_SIZE,
+        ),
+    )
+
+
+# Общие на весь процесс клиенты: keep-alive соединения переиспользуются между сессиями Streamlit
+http2_enabled = _http2_available()
+http_session = _build_session()
+_gigachat_http = None
+
+
+def gigachat_http():
+    # httpx нужен только клиентам gigachat, поэтому создаём его вместе с первым из них
+    global _gigachat_http
+    with _lock:
+        if _gigachat_http is None:
+            _gigachat_http = _build_gigachat_client(http2_enabled)
+    return _gigachat_http
+
+
+def share_pool(client):
+    """Подменяет собственный httpx клиент gigachat.GigaChat на общий пул."""
+    if hasattr(client, "_client_instance"):
+        # gigachat>=0.2 хранит клиент в атрибуте за обычным property
+        client._client_instance = gigachat_http()
+    else:
+        client.__dict__["_client"] = gigachat_http()
+    return client
+
+
+def pool_stats():
+    stats = {"requests": {}, "gigachat": {}}
+    for adapter in set(http_session.adapters.values()):
+        for key in adapter.poolmanager.pools.keys():
+            pool = adapter.poolmanager.pools[key]
+            stats["requests"][f"{pool.host}:{pool.port}"] = {
+                "connections_opened": pool.num_connections,
+                "requests": pool.num_requests,
+                "idle": pool.pool.qsize() if pool.pool is not None else 0,
+                "maxsize": HTTP_POOL_SIZE,
+            }
+
+    connections = getattr(getattr(_gigachat_http, "_transport", None), "_pool", None)
+    connections = getattr(connections, "connections", [])
+    stats["gigachat"] = {
+        "connections": len(connections),
+        "idle": sum(1 for conn in connections if conn.is_idle()),
+        "max_connections": HTTP_POOL_SIZE,
+        "http2": http2_enabled,
+    }
+    with _lock:
+        stats["requests_by_host"] = dict(_requests_by_host)
+    return stats
+
+
+metrics.register("http_pool", pool_stats)
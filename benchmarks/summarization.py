@@ -0,0 +1,107 @@
+"""Сравнение суммаризации полного текста и текста после локального отбора ключевых предложений.
+
+Запуск из корня репозитория:
+
+    python -m benchmarks.summarization [файлы .txt/.pdf или ссылки на PDF] [--budget N | --ratio R] [--live]
+
+Без аргументов все тексты из resources/tests/test_document_store склеиваются в один документ:
+по отдельности в каждом лишь несколько предложений. Без --live считаются только
+токены, число запросов к модели и время локального отбора; с --live оба варианта отправляются в GigaChat.
+
+Бюджет отбора по умолчанию - EXTRACTIVE_SUMMARY_TOKENS, но не больше доли --ratio от длины документа:
+тестовые тексты короче бюджета, и без этого отбор оставлял бы их целиком. Разницу в числе запросов
+видно только на документах длиннее DOC_SUMMARY_CHUNK_TOKENS; для настоящих замеров передайте PDF статей.
+"""
+import argparse
+import glob
+import os
+import time
+from app.common import DOC_SUMMARY_FANOUT, EXTRACTIVE_SUMMARY_TOKENS, estimate_tokens
+from app.common.extractive import extract_key_sentences
+from app.common.summarize import document_chunks, summarize_document
+
+DOCUMENT_STORE = os.path.join(".", "resources", "tests", "test_document_store")
+# Доля документа, до которой сжимать тексты короче EXTRACTIVE_SUMMARY_TOKENS
+DEFAULT_RATIO = 0.3
+
+
+def load_document(source):
+    if source.startswith(("http://", "https://")):
+        from app.common.pdf import clean_pdf_pages
+        from app.common.pdf_cache import fetch_pdf_pages
+
+        pages, _ = fetch_pdf_pages(source)
+        return clean_pdf_pages(pages)
+    if source.lower().endswith(".pdf"):
+        from app.common.pdf import extract_pdf_text
+
+        with open(source, "rb") as f:
+            text, _ = extract_pdf_text(f)
+        return text
+    with open(source, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def planned_calls(chunk_count, fanout=DOC_SUMMARY_FANOUT):
+    # Повторяет схему summarize_document: фрагменты, промежуточные свёртки и итоговый запрос
+    if chunk_count == 0:
+        return 0
+    calls = chunk_count if chunk_count > 1 else 0
+    remaining = chunk_count
+    while remaining > fanout:
+        remaining = -(-remaining // fanout)
+        calls += remaining
+    return calls + 1
+
+
+def budget_for(text, budget=None, ratio=DEFAULT_RATIO):
+    if budget is not None:
+        return budget
+    return max(min(EXTRACTIVE_SUMMARY_TOKENS, int(estimate_tokens(text) * ratio)), 1)
+
+
+def measure(text, budget, live):
+    started = time.perf_counter()
+    extracted = extract_key_sentences(text, budget)
+    extract_ms = (time.perf_counter() - started) * 1000
+
+    full_chunks = document_chunks(text, extractive=False)
+    short_chunks = document_chunks(extracted, extractive=False)
+    row = {
+        "budget": budget,
+        "tokens_full": sum(estimate_tokens(chunk) for chunk in full_chunks),
+        "tokens_extractive": sum(estimate_tokens(chunk) for chunk in short_chunks),
+        "calls_full": planned_calls(len(full_chunks)),
+        "calls_extractive": planned_calls(len(short_chunks)),
+        "extract_ms": round(extract_ms, 1),
+    }
+    if live:
+        for name, document in (("full", text), ("extractive", extracted)):
+            started = time.perf_counter()
+            summarize_document(document, extractive=False)
+            row[f"latency_{name}_s"] = round(time.perf_counter() - started, 2)
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("sources", nargs="*", help="файлы .txt/.pdf или ссылки на PDF")
+    parser.add_argument("--budget", type=int, default=None,
+                        help="бюджет токенов локального отбора (по умолчанию зависит от длины документа)")
+    parser.add_argument("--ratio", type=float, default=DEFAULT_RATIO,
+                        help="доля документа, до которой сжимать тексты короче EXTRACTIVE_SUMMARY_TOKENS")
+    parser.add_argument("--live", action="store_true", help="отправить оба варианта в GigaChat и замерить задержку")
+    args = parser.parse_args()
+
+    if args.sources:
+        documents = [(os.path.basename(source), load_document(source)) for source in args.sources]
+    else:
+        store = sorted(glob.glob(os.path.join(DOCUMENT_STORE, "*.txt")))
+        documents = [(os.path.basename(DOCUMENT_STORE), "\n\n".join(load_document(source) for source in store))]
+    for name, text in documents:
+        row = measure(text, budget_for(text, args.budget, args.ratio), args.live)
+        print(f"{name}: " + ", ".join(f"{key}={value}" for key, value in row.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+import os
+import unittest
+
+os.environ.setdefault("AUTH_DATA", "dGVzdA==")
+
+import httpx
+from gigachat import exceptions
+
+from app.common.ratelimit import _classify, _is_throttle, is_upstream_failure
+
+URL = "https://gigachat.devices.sberbank.ru/api/v1/chat/completions"
+
+
+class SdkErrorClassificationTest(unittest.TestCase):
+    """Ошибки ответа gigachat должны повторяться, замедлять limiter и учитываться circuit breaker."""
+
+    def test_rate_limit_uses_retry_after(self):
+        error = exceptions.RateLimitError(URL, 429, b"Too Many Requests", httpx.Headers({"Retry-After": "7"}))
+        self.assertEqual(_classify(error), (True, 7.0))
+        self.assertTrue(_is_throttle(error))
+        self.assertTrue(is_upstream_failure(error))
+
+    def test_server_error_is_retried(self):
+        error = exceptions.ServerError(URL, 503, b"Service Unavailable", httpx.Headers())
+        self.assertEqual(_classify(error), (True, None))
+        self.assertFalse(_is_throttle(error))
+        self.assertTrue(is_upstream_failure(error))
+
+    def test_client_error_is_not_retried(self):
+        error = exceptions.BadRequestError(URL, 400, b"Bad Request", None)
+        self.assertEqual(_classify(error), (False, None))
+        self.assertFalse(is_upstream_failure(error))
+
+
+if __name__ == "__main__":
+    unittest.main()